@@ -4,3 +4,4 @@ from .craft import CRAFT
 from .craft_utils import *
 from .imgproc import *
 from .file_utils import *
+from .backends import *
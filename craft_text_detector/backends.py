@@ -0,0 +1,158 @@
+"""
+Inference backends for CRAFT: eager PyTorch, TorchScript and ONNX Runtime (CPU).
+Graphs are exported for a fixed set of canvas buckets (see export_craft.py) but take any canvas size: the ONNX
+graphs have dynamic height and width and the TorchScript traces of CRAFT follow the input shape. A canvas runs
+unpadded on the graph of the smallest bucket that holds it, so the score maps match the eager model's on the same
+canvas; padding it would change the scores near the padded edges.
+"""
+import os
+import re
+
+import torch
+import torch.nn as nn
+
+BACKEND_EXTENSIONS = {'torchscript': '.pt', 'onnxruntime': '.onnx'}
+
+
+class CraftScoreMaps(nn.Module):
+    """ CRAFT and the optional link refiner as one module. Return: score_text, score_link [b, h/2, w/2] """
+
+    def __init__(self, craft, refine_net=None):
+        super(CraftScoreMaps, self).__init__()
+        self.craft = craft
+        self.refine_net = refine_net
+
+    def forward(self, x):
+        y, feature = self.craft(x)
+        if self.refine_net is not None:
+            score_link = self.refine_net(y, feature)[:, :, :, 0]
+        else:
+            score_link = y[:, :, :, 1]
+        return y[:, :, :, 0], score_link
+
+
+def export_name(bucket, refine, backend):
+    """ file name of the graph exported for one (height, width) bucket """
+    return 'craft%s_%dx%d%s' % ('_refiner' if refine else '', bucket[0], bucket[1], BACKEND_EXTENSIONS[backend])
+
+
+def export_torchscript(model, bucket, path):
+    x = torch.zeros(1, 3, bucket[0], bucket[1], device=next(model.parameters()).device)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model.eval(), x))
+    traced.save(path)
+
+
+def export_onnx(model, bucket, path, opset_version=17):
+    x = torch.zeros(1, 3, bucket[0], bucket[1], device=next(model.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(model.eval(), x, path, input_names=['image'], output_names=['score_text', 'score_link'],
+                          dynamic_axes={'image': {0: 'batch', 2: 'height', 3: 'width'},
+                                        'score_text': {0: 'batch', 1: 'map_height', 2: 'map_width'},
+                                        'score_link': {0: 'batch', 1: 'map_height', 2: 'map_width'}},
+                          opset_version=opset_version, dynamo=False)
+
+
+EXPORTERS = {'torchscript': export_torchscript, 'onnxruntime': export_onnx}
+
+
+class EagerBackend(object):
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, x):
+        with torch.no_grad():
+            return self.model(x)
+
+
+class BucketedBackend(object):
+    """ Runs graphs exported for (height, width) canvas buckets.
+    graphs are callables on [b, 3, height, width] tensors of any canvas size up to their bucket. A canvas goes,
+    unpadded, to the graph of the smallest bucket that holds it; canvases larger than every bucket go to
+    fallback, or raise ValueError without one.
+    """
+
+    def __init__(self, graphs, fallback=None):
+        self.graphs = graphs
+        self.fallback = fallback
+
+    def bucket(self, height, width):
+        fits = [b for b in self.graphs if b[0] >= height and b[1] >= width]
+        return min(fits, key=lambda b: b[0] * b[1]) if fits else None
+
+    def __call__(self, x):
+        height, width = x.shape[2:]
+        bucket = self.bucket(height, width)
+        if bucket is None:
+            if self.fallback is None:
+                raise ValueError('no exported CRAFT graph fits a %dx%d canvas (buckets: %s)'
+                                 % (height, width, sorted(self.graphs)))
+            return self.fallback(x)
+        return self.run(self.graphs[bucket], x)
+
+    def run(self, graph, x):
+        with torch.no_grad():
+            return graph(x)
+
+
+class TorchScriptBackend(BucketedBackend):
+    def __init__(self, paths, device, fallback=None):
+        graphs = {bucket: torch.jit.load(path, map_location=device) for bucket, path in paths.items()}
+        super(TorchScriptBackend, self).__init__(graphs, fallback)
+
+
+class OnnxRuntimeBackend(BucketedBackend):
+    def __init__(self, paths, fallback=None, num_threads=0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("craft_backend='onnxruntime' needs the onnxruntime package (pip install onnxruntime)")
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        graphs = {bucket: onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+                  for bucket, path in paths.items()}
+        super(OnnxRuntimeBackend, self).__init__(graphs, fallback)
+
+    def run(self, graph, x):
+        score_text, score_link = graph.run(None, {'image': x.cpu().numpy()})
+        return torch.from_numpy(score_text).to(x.device), torch.from_numpy(score_link).to(x.device)
+
+
+def exported_graphs(export_dir, refine, backend):
+    """ Return: {(height, width): path} of the graphs in export_dir for this backend and refiner setting """
+    pattern = re.compile(r'craft%s_(\d+)x(\d+)%s$' % ('_refiner' if refine else '', re.escape(BACKEND_EXTENSIONS[backend])))
+    paths = {}
+    for name in sorted(os.listdir(export_dir)) if os.path.isdir(export_dir) else []:
+        match = pattern.match(name)
+        if match:
+            paths[(int(match.group(1)), int(match.group(2)))] = os.path.join(export_dir, name)
+    return paths
+
+
+def load_backend(backend, model, export_dir=None, device='cpu', fallback_to_eager=True):
+    """ Build the CRAFT backend named in Config.craft_backend: 'eager', 'torchscript' or 'onnxruntime'.
+    model is the eager CraftScoreMaps; it also serves canvases larger than every exported bucket unless
+    fallback_to_eager is off.
+    """
+    eager = EagerBackend(model)
+    if backend == 'eager':
+        return eager
+    if backend not in BACKEND_EXTENSIONS:
+        raise ValueError('unknown CRAFT backend %r, expected eager, torchscript or onnxruntime' % backend)
+
+    paths = exported_graphs(export_dir, model.refine_net is not None, backend)
+    if not paths:
+        raise FileNotFoundError('no %s CRAFT graphs in %s, run export_craft.py first' % (backend, export_dir))
+    fallback = eager if fallback_to_eager else None
+    if backend == 'torchscript':
+        return TorchScriptBackend(paths, device, fallback)
+    return OnnxRuntimeBackend(paths, fallback)
+
+
+def max_score_difference(reference, backend, inputs):
+    """ largest absolute difference of score_text and score_link between two backends over a list of inputs """
+    difference = 0.0
+    for x in inputs:
+        for r, o in zip(reference(x), backend(x)):
+            difference = max(difference, (r.float() - o.float().to(r.device)).abs().max().item())
+    return difference
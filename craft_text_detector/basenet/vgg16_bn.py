@@ -3,8 +3,9 @@ from collections import namedtuple
 import torch
 import torch.nn as nn
 import torch.nn.init as init
-from torchvision import models
-from torchvision.models.vgg import model_urls
+
+# torchvision's vgg16_bn configuration 'D': conv widths, 'M' for max pooling
+vgg16_cfg = [64, 64, 'M', 128, 128, 'M', 256, 256, 256, 'M', 512, 512, 512, 'M', 512, 512, 512, 'M']
 
 def init_weights(modules):
     for m in modules:
@@ -19,11 +20,29 @@ def init_weights(modules):
             m.weight.data.normal_(0, 0.01)
             m.bias.data.zero_()
 
+def vgg16_bn_features():
+    """ same layers (and indices) as torchvision.models.vgg16_bn().features, without building the classifier """
+    layers = []
+    in_channels = 3
+    for v in vgg16_cfg:
+        if v == 'M':
+            layers.append(nn.MaxPool2d(kernel_size=2, stride=2))
+        else:
+            layers += [nn.Conv2d(in_channels, v, kernel_size=3, padding=1), nn.BatchNorm2d(v), nn.ReLU(inplace=True)]
+            in_channels = v
+    return nn.Sequential(*layers)
+
 class vgg16_bn(torch.nn.Module):
     def __init__(self, pretrained=True, freeze=True):
         super(vgg16_bn, self).__init__()
-        model_urls['vgg16_bn'] = model_urls['vgg16_bn'].replace('https://', 'http://')
-        vgg_pretrained_features = models.vgg16_bn(pretrained=pretrained).features
+        if pretrained:
+            # torchvision is only needed to download the ImageNet weights
+            from torchvision import models
+            from torchvision.models.vgg import model_urls
+            model_urls['vgg16_bn'] = model_urls['vgg16_bn'].replace('https://', 'http://')
+            vgg_pretrained_features = models.vgg16_bn(pretrained=pretrained).features
+        else:
+            vgg_pretrained_features = vgg16_bn_features()
         self.slice1 = torch.nn.Sequential()
         self.slice2 = torch.nn.Sequential()
         self.slice3 = torch.nn.Sequential()
@@ -7,21 +7,41 @@ MIT License
 import numpy as np
 import cv2
 import math
+from scipy import ndimage
+
+# bits of the packed score map: text > low_text, link > link_threshold, text >= text_threshold
+TEXT_BIT, LINK_BIT, STRONG_BIT = 1, 2, 4
 
 """ auxilary functions """
 # unwarp corodinates
 def warpCoord(Minv, pt):
     out = np.matmul(Minv, (pt[0], pt[1], 1))
     return np.array([out[0]/out[2], out[1]/out[2]])
+
+# labelled reductions over all connected components in one pass
+def getComponentScores(textmap, labels, nLabels, linkmap=None):
+    index = np.arange(nLabels)
+    max_text = np.asarray(ndimage.maximum(textmap, labels, index))
+    area = np.bincount(labels.ravel(), minlength=nLabels)
+    mean_link = None
+    if linkmap is not None:
+        mean_link = np.bincount(labels.ravel(), weights=linkmap.ravel(), minlength=nLabels) / np.maximum(area, 1)
+    return max_text, area, mean_link
+
+# test whether a 1px line, rasterized exactly as cv2.line does, touches the mask; only the line's bounding box is drawn
+def lineHitsMask(mask, p):
+    x0, y0, x1, y1 = int(p[0]), int(p[1]), int(p[2]), int(p[3])
+    img_h, img_w = mask.shape
+    sx, ex = max(min(x0, x1), 0), min(max(x0, x1) + 1, img_w)
+    sy, ey = max(min(y0, y1), 0), min(max(y0, y1) + 1, img_h)
+    if sx >= ex or sy >= ey: return False
+    line_img = np.zeros((ey - sy, ex - sx), dtype=np.uint8)
+    cv2.line(line_img, (x0 - sx, y0 - sy), (x1 - sx, y1 - sy), 1, thickness=1)
+    return bool(np.any(mask[sy:ey, sx:ex][line_img != 0]))
 """ end of auxilary functions """
 
 
 def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text):
-    # prepare data
-    linkmap = linkmap.copy()
-    textmap = textmap.copy()
-    img_h, img_w = textmap.shape
-
     """ labeling method """
     ret, text_score = cv2.threshold(textmap, low_text, 1, 0)
     ret, link_score = cv2.threshold(linkmap, link_threshold, 1, 0)
@@ -29,20 +49,42 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
     text_score_comb = np.clip(text_score + link_score, 0, 1)
     nLabels, labels, stats, centroids = cv2.connectedComponentsWithStats(text_score_comb.astype(np.uint8), connectivity=4)
 
+    # link pixels that are not text are removed from every segmentation map
+    link_area = np.logical_and(link_score==1, text_score==0)
+
+    # size filtering and thresholding for all components at once
+    max_text, area, _ = getComponentScores(textmap, labels, nLabels)
+    keep = np.logical_and(area >= 1, max_text >= text_threshold)
+
+    det, mapper = getComponentBoxes_core(labels, stats, link_area, keep)
+    return det, labels, mapper
+
+def getDetBoxes_packed_core(scoremask):
+    """ same as getDetBoxes_core, on a map already thresholded and packed with TEXT_BIT / LINK_BIT / STRONG_BIT """
+    text_score = (scoremask & TEXT_BIT) != 0
+    link_score = (scoremask & LINK_BIT) != 0
+    nLabels, labels, stats, centroids = cv2.connectedComponentsWithStats(np.logical_or(text_score, link_score).astype(np.uint8), connectivity=4)
+
+    link_area = np.logical_and(link_score, ~text_score)
+
+    # a component passes the text_threshold filter if it holds at least one strong text pixel
+    keep = np.zeros(nLabels, dtype=bool)
+    keep[labels[(scoremask & STRONG_BIT) != 0]] = True
+    keep = np.logical_and(keep, stats[:, cv2.CC_STAT_AREA] >= 1)
+
+    det, mapper = getComponentBoxes_core(labels, stats, link_area, keep)
+    return det, labels, mapper
+
+def getComponentBoxes_core(labels, stats, link_area, keep):
+    img_h, img_w = labels.shape
+    keep[0] = False     # background
+
     det = []
     mapper = []
-    for k in range(1,nLabels):
-        # size filtering
+    for k in np.nonzero(keep)[0]:
         size = stats[k, cv2.CC_STAT_AREA]
-        if size < 1: continue
-
-        # thresholding
-        if np.max(textmap[labels==k]) < text_threshold: continue
 
-        # make segmentation map
-        segmap = np.zeros(textmap.shape, dtype=np.uint8)
-        segmap[labels==k] = 255
-        segmap[np.logical_and(link_score==1, text_score==0)] = 0   # remove link area
+        # work only inside the component's bounding box plus the dilation margin
         x, y = stats[k, cv2.CC_STAT_LEFT], stats[k, cv2.CC_STAT_TOP]
         w, h = stats[k, cv2.CC_STAT_WIDTH], stats[k, cv2.CC_STAT_HEIGHT]
         niter = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
@@ -52,11 +94,17 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
         if sy < 0 : sy = 0
         if ex >= img_w: ex = img_w
         if ey >= img_h: ey = img_h
+        roi_mask = labels[sy:ey, sx:ex] == k
+
+        # make segmentation map
+        segmap = np.zeros(roi_mask.shape, dtype=np.uint8)
+        segmap[roi_mask] = 255
+        segmap[link_area[sy:ey, sx:ex]] = 0   # remove link area
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT,(1 + niter, 1 + niter))
-        segmap[sy:ey, sx:ex] = cv2.dilate(segmap[sy:ey, sx:ex], kernel)
+        segmap = cv2.dilate(segmap, kernel)
 
         # make box
-        np_contours = np.roll(np.array(np.where(segmap!=0)),1,axis=0).transpose().reshape(-1,2)
+        np_contours = np.roll(np.array(np.where(segmap!=0)),1,axis=0).transpose().reshape(-1,2) + (sx, sy)
         rectangle = cv2.minAreaRect(np_contours)
         box = cv2.boxPoints(rectangle)
 
@@ -76,7 +124,7 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
         det.append(box)
         mapper.append(k)
 
-    return det, labels, mapper
+    return det, mapper
 
 def getPoly_core(boxes, labels, mapper, linkmap):
     # configs
@@ -108,15 +156,13 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         word_label[word_label > 0] = 1
 
         """ Polygon generation """
-        # find top/bottom contours
-        cp = []
-        max_len = -1
-        for i in range(w):
-            region = np.where(word_label[:,i] != 0)[0]
-            if len(region) < 2 : continue
-            cp.append((i, region[0], region[-1]))
-            length = region[-1] - region[0] + 1
-            if length > max_len: max_len = length
+        # find top/bottom contours of every column with at least two label pixels
+        word_mask = word_label != 0
+        cols = np.nonzero(np.count_nonzero(word_mask, axis=0) >= 2)[0]
+        tops = word_mask.argmax(axis=0)[cols]
+        bottoms = h - 1 - word_mask[::-1].argmax(axis=0)[cols]
+        cp = list(zip(cols.tolist(), tops.tolist(), bottoms.tolist()))
+        max_len = int((bottoms - tops + 1).max()) if len(cols) > 0 else -1
 
         # pass if max_len is similar to h
         if h * max_len_ratio < max_len:
@@ -186,19 +232,15 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         for r in np.arange(0.5, max_r, step_r):
             dx = 2 * half_char_h * r
             if not isSppFound:
-                line_img = np.zeros(word_label.shape, dtype=np.uint8)
                 dy = grad_s * dx
                 p = np.array(new_pp[0]) - np.array([dx, dy, dx, dy])
-                cv2.line(line_img, (int(p[0]), int(p[1])), (int(p[2]), int(p[3])), 1, thickness=1)
-                if np.sum(np.logical_and(word_label, line_img)) == 0 or r + 2 * step_r >= max_r:
+                if not lineHitsMask(word_mask, p) or r + 2 * step_r >= max_r:
                     spp = p
                     isSppFound = True
             if not isEppFound:
-                line_img = np.zeros(word_label.shape, dtype=np.uint8)
                 dy = grad_e * dx
                 p = np.array(new_pp[-1]) + np.array([dx, dy, dx, dy])
-                cv2.line(line_img, (int(p[0]), int(p[1])), (int(p[2]), int(p[3])), 1, thickness=1)
-                if np.sum(np.logical_and(word_label, line_img)) == 0 or r + 2 * step_r >= max_r:
+                if not lineHitsMask(word_mask, p) or r + 2 * step_r >= max_r:
                     epp = p
                     isEppFound = True
             if isSppFound and isEppFound:
@@ -234,6 +276,16 @@ def getDetBoxes(textmap, linkmap, text_threshold, link_threshold, low_text, poly
 
     return boxes, polys
 
+def getDetBoxes_packed(scoremask, poly=False):
+    boxes, labels, mapper = getDetBoxes_packed_core(scoremask)
+
+    if poly:
+        polys = getPoly_core(boxes, labels, mapper, None)
+    else:
+        polys = [None] * len(boxes)
+
+    return boxes, polys
+
 def adjustResultCoordinates(polys, ratio_w, ratio_h, ratio_net = 2):
     if len(polys) > 0:
         polys = np.array(polys)
@@ -242,3 +294,28 @@ def adjustResultCoordinates(polys, ratio_w, ratio_h, ratio_net = 2):
                 polys[k] *= (ratio_w * ratio_net, ratio_h * ratio_net)
     return polys
 
+
+def mergeTileBoxes(polys, at_seam, overlap_threshold=0.5):
+    """ Overlap-aware NMS for detections gathered from overlapping tiles.
+    Overlap is measured as intersection over the smaller axis-aligned extent, so a word cut by one tile's
+    border is suppressed by the complete copy found in the neighbouring tile. Detections that do not touch
+    an inner tile border win, then larger ones.
+    Return: indices of the kept polys
+    """
+    if len(polys) == 0:
+        return []
+    rects = np.array([np.concatenate([p.min(axis=0), p.max(axis=0)]) for p in polys], dtype=np.float32)
+    areas = np.prod(rects[:, 2:] - rects[:, :2], axis=1)
+    order = np.lexsort((-areas, np.asarray(at_seam)))
+
+    keep = []
+    for i in order:
+        if keep:
+            k = rects[keep]
+            iw = np.minimum(k[:, 2], rects[i, 2]) - np.maximum(k[:, 0], rects[i, 0])
+            ih = np.minimum(k[:, 3], rects[i, 3]) - np.maximum(k[:, 1], rects[i, 1])
+            inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+            if np.any(inter > overlap_threshold * np.maximum(np.minimum(areas[keep], areas[i]), 1e-6)):
+                continue
+        keep.append(i)
+    return sorted(keep)
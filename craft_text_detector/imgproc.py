@@ -7,6 +7,7 @@ MIT License
 import numpy as np
 from skimage import io
 import cv2
+from collections import OrderedDict
 
 def loadImage(img_file):
     img = io.imread(img_file)           # RGB order
@@ -64,6 +65,62 @@ def resize_aspect_ratio(img, square_size, interpolation, mag_ratio=1):
 
     return resized, ratio, size_heatmap
 
+class CanvasPreprocessor(object):
+    """ resize_aspect_ratio + normalizeMeanVariance in one pass, written into reusable float32 CHW buffers.
+    Buffers are kept per shape (least recently used ones are dropped beyond max_buffers), so the array returned
+    by __call__ / buffer() is overwritten by the next request of the same shape.
+    """
+
+    def __init__(self, square_size, mag_ratio=1, interpolation=cv2.INTER_LINEAR,
+                 mean=(0.485, 0.456, 0.406), variance=(0.229, 0.224, 0.225), max_buffers=8):
+        self.square_size = square_size
+        self.mag_ratio = mag_ratio
+        self.interpolation = interpolation
+        self.mean = np.array([m * 255.0 for m in mean], dtype=np.float32)
+        self.variance = np.array([v * 255.0 for v in variance], dtype=np.float32)
+        self.pad_value = -self.mean / self.variance     # normalized value of the zero canvas padding
+        self.max_buffers = max_buffers
+        self.buffers = OrderedDict()
+
+    def canvas_size(self, img):
+        """ same sizes as resize_aspect_ratio. Return: target_h, target_w, ratio, (target_h32, target_w32) """
+        height, width = img.shape[:2]
+        target_size = self.mag_ratio * max(height, width)
+        if target_size > self.square_size:
+            target_size = self.square_size
+        ratio = target_size / max(height, width)
+        target_h, target_w = int(height * ratio), int(width * ratio)
+        return target_h, target_w, ratio, (target_h + (32 - target_h % 32) % 32, target_w + (32 - target_w % 32) % 32)
+
+    def buffer(self, shape):
+        shape = tuple(shape)
+        buf = self.buffers.pop(shape, None)
+        if buf is None:
+            buf = np.empty(shape, dtype=np.float32)
+            while len(self.buffers) >= self.max_buffers:
+                self.buffers.popitem(last=False)
+        self.buffers[shape] = buf
+        return buf
+
+    def fill(self, img, out):
+        """ resize img (RGB) and write it normalized into out [3, H, W], padding the rest. Return: ratio """
+        target_h, target_w, ratio, _ = self.canvas_size(img)
+        proc = cv2.resize(img, (target_w, target_h), interpolation=self.interpolation)
+        for c in range(3):
+            canvas = out[c, :target_h, :target_w]
+            np.subtract(proc[:, :, c], self.mean[c], out=canvas, dtype=np.float32)
+            canvas /= self.variance[c]
+            out[c, target_h:, :] = self.pad_value[c]
+            out[c, :target_h, target_w:] = self.pad_value[c]
+        return ratio
+
+    def __call__(self, img):
+        """ Return: contiguous [1, 3, h32, w32] canvas, ratio, size_heatmap (as resize_aspect_ratio) """
+        _, _, _, (target_h32, target_w32) = self.canvas_size(img)
+        x = self.buffer((1, 3, target_h32, target_w32))
+        ratio = self.fill(img, x[0])
+        return x, ratio, (int(target_w32/2), int(target_h32/2))
+
 def cvt2HeatmapImg(img):
     img = (np.clip(img, 0, 1) * 255).astype(np.uint8)
     img = cv2.applyColorMap(img, cv2.COLORMAP_JET)
@@ -0,0 +1,142 @@
+import os
+import copy
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+def model_identity(paths):
+	""" Identity of the detection weights: path, size and modification time of each file (None entries are skipped),
+	so replacing a checkpoint invalidates every cached result, on disk too.
+	"""
+	parts = []
+	for path in paths:
+		if path is None:
+			continue
+		path = os.path.abspath(path)
+		try:
+			st = os.stat(path)
+			parts.append((path, st.st_size, st.st_mtime_ns))
+		except OSError:
+			parts.append((path, None, None))
+	return repr(parts)
+
+class DetectionCache:
+	""" Content-addressed cache of detection results (boxes, polys, optional score_text, target_ratio).
+	Entries are keyed by a hash of the decoded image, the config fields that change detection output and the
+	identity of the detection weights (model_id, see model_identity). They live in an in-memory LRU bounded by
+	max_bytes and, when cache_dir is set, are also written there as one .npz of plain arrays per key (loaded
+	without pickle). The disk tier is bounded by max_disk_bytes, evicting the least recently used files by mtime.
+	"""
+	config_fields = ('craft_canvas_size', 'craft_mag_ratio', 'craft_text_threshold', 'craft_link_threshold',
+		'craft_low_text', 'craft_poly', 'craft_refine', 'craft_tile_size', 'craft_tile_mag_ratio', 'craft_tile_overlap',
+		'craft_tile_nms_threshold')
+
+	def __init__(self, max_bytes, cache_dir=None, max_disk_bytes=None, model_id=''):
+		self.max_bytes = max_bytes
+		self.cache_dir = cache_dir
+		self.max_disk_bytes = max_disk_bytes
+		self.model_id = model_id
+		self.entries = OrderedDict()
+		self.nbytes = 0
+		self.disk_bytes = 0
+		if self.cache_dir is not None:
+			os.makedirs(self.cache_dir, exist_ok=True)
+			self.disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+	def key(self, image, cfg):
+		image = np.ascontiguousarray(image)
+		h = hashlib.blake2b(digest_size=16)
+		h.update(repr((image.shape, image.dtype.str, self.model_id) + tuple(getattr(cfg, f) for f in self.config_fields)).encode())
+		h.update(image.data)
+		return h.hexdigest()
+
+	def get(self, key):
+		""" Return: (boxes, polys, score_text, target_ratio) or None on a miss. score_text is None when it was not stored """
+		entry = self.entries.get(key)
+		if entry is not None:
+			self.entries.move_to_end(key)
+		elif self.cache_dir is not None:
+			entry = self._load(key)
+			if entry is not None:
+				self._remember(key, entry)
+		if entry is None:
+			return None
+		boxes, polys, score_text, target_ratio = entry
+		return copy.deepcopy(boxes), copy.deepcopy(polys), score_text, target_ratio
+
+	def put(self, key, boxes, polys, score_text, target_ratio):
+		if score_text is not None:
+			score_text = score_text.copy()
+			score_text.setflags(write=False)
+		entry = (copy.deepcopy(boxes), copy.deepcopy(polys), score_text, target_ratio)
+		self._remember(key, entry)
+		if self.cache_dir is not None:
+			self._store(key, entry)
+
+	def _remember(self, key, entry):
+		if key in self.entries:
+			self.nbytes -= self._size(self.entries.pop(key))
+		size = self._size(entry)
+		if size > self.max_bytes:
+			return
+		self.entries[key] = entry
+		self.nbytes += size
+		while self.nbytes > self.max_bytes:
+			_, evicted = self.entries.popitem(last=False)
+			self.nbytes -= self._size(evicted)
+
+	def _size(self, entry):
+		boxes, polys, score_text, _ = entry
+		size = sum(np.asarray(b).nbytes for b in boxes) + sum(np.asarray(p).nbytes for p in polys if p is not None)
+		if score_text is not None:
+			size += score_text.nbytes
+		return size
+
+	def _path(self, key):
+		return os.path.join(self.cache_dir, key + '.npz')
+
+	def _disk_files(self):
+		return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.npz')]
+
+	def _store(self, key, entry):
+		boxes, polys, score_text, target_ratio = entry
+		polys = [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in polys]
+		arrays = {'boxes': np.asarray(boxes, dtype=np.float32).reshape(-1, 4, 2),
+			'poly_points': np.concatenate(polys) if polys else np.zeros((0, 2), np.float32),
+			'poly_sizes': np.array([len(p) for p in polys], dtype=np.int64),
+			'target_ratio': np.float64(target_ratio)}
+		if score_text is not None:
+			arrays['score_text'] = score_text
+		path = self._path(key)
+		if os.path.exists(path):
+			self.disk_bytes -= os.path.getsize(path)
+		tmp_path = path + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			np.savez(f, **arrays)
+		os.replace(tmp_path, path)
+		self.disk_bytes += os.path.getsize(path)
+		if self.max_disk_bytes is not None and self.disk_bytes > self.max_disk_bytes:
+			self._evict_disk()
+
+	def _load(self, key):
+		path = self._path(key)
+		try:
+			with np.load(path, allow_pickle=False) as data:
+				boxes = data['boxes']
+				polys = np.split(data['poly_points'], np.cumsum(data['poly_sizes'])[:-1]) if len(data['poly_sizes']) else []
+				score_text = data['score_text'] if 'score_text' in data.files else None
+				target_ratio = float(data['target_ratio'])
+		except (OSError, KeyError, ValueError):
+			return None
+		os.utime(path)    # mtime is the recency of the disk LRU
+		if score_text is not None:
+			score_text.setflags(write=False)
+		return boxes, polys, score_text, target_ratio
+
+	def _evict_disk(self):
+		files = sorted(self._disk_files(), key=os.path.getmtime)
+		for path in files:
+			if self.disk_bytes <= self.max_disk_bytes:
+				break
+			self.disk_bytes -= os.path.getsize(path)
+			os.remove(path)
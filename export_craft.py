@@ -0,0 +1,73 @@
+""" Export CRAFT (and the optional link refiner) to TorchScript and ONNX, one graph per canvas bucket.
+OCR runs them when Config.craft_backend is 'torchscript' or 'onnxruntime' and craft_export_dir points here.
+A canvas runs, unpadded, on the graph of the smallest bucket that holds it and larger canvases fall back to the
+eager model, so cover the canvas sizes your images produce, e.g. --buckets 1280x960 960x1280 1280x1280.
+With --check the score maps of every exported graph are compared with the eager model on the same canvases.
+"""
+import os
+import argparse
+import torch
+from ocr_config import Config
+from ocr_utils import copyStateDict, fold_batchnorms_checked
+from craft_text_detector import CRAFT, CraftScoreMaps, EagerBackend, EXPORTERS, export_name, load_backend, max_score_difference
+
+def load_model(args):
+	craft = CRAFT()
+	craft.load_state_dict(copyStateDict(torch.load(args.trained_model, map_location='cpu')))
+	craft.eval()
+	refine_net = None
+	if args.refine:
+		from craft_text_detector.refinenet import RefineNet
+		refine_net = RefineNet()
+		refine_net.load_state_dict(copyStateDict(torch.load(args.refiner_model, map_location='cpu')))
+		refine_net.eval()
+	model = CraftScoreMaps(craft, refine_net).eval()
+	if not args.no_fold:
+		x = torch.randn(1, 3, 256, 256)
+		model = fold_batchnorms_checked(model, lambda m: m(x))
+	return model
+
+def check(model, args):
+	""" score maps of the exported graphs against eager, on random canvases that exactly fill each bucket
+	and on smaller ones served by the same graph """
+	eager = EagerBackend(model)
+	ok = True
+	for backend in args.backends:
+		exported = load_backend(backend, model, args.export_dir, fallback_to_eager=False)
+		for h, w in args.buckets:
+			inputs = [torch.randn(2, 3, h, w), torch.randn(1, 3, max(32, h - 64), max(32, w - 96))]
+			difference = max_score_difference(eager, exported, inputs)
+			passed = difference <= args.tolerance
+			ok = ok and passed
+			print('%-12s %dx%d\tmax |diff| %.2e\t%s' % (backend, h, w, difference, 'ok' if passed else 'FAILED'))
+	return ok
+
+if __name__ == '__main__':
+	cfg = Config()
+	parser = argparse.ArgumentParser(description='Export CRAFT to TorchScript / ONNX for fixed canvas buckets')
+	parser.add_argument('--trained_model', default=cfg.craft_model, type=str, help='pretrained CRAFT model')
+	parser.add_argument('--refine', action='store_true', help='include the link refiner')
+	parser.add_argument('--refiner_model', default=cfg.craft_refiner_model, type=str, help='pretrained refiner model')
+	parser.add_argument('--buckets', nargs='+', default=['%dx%d' % (cfg.craft_canvas_size, cfg.craft_canvas_size)],
+		help='canvas sizes HxW, multiples of 32')
+	parser.add_argument('--backends', nargs='+', default=['torchscript', 'onnxruntime'], choices=sorted(EXPORTERS))
+	parser.add_argument('--export_dir', default=cfg.craft_export_dir, type=str, help='output folder (Config.craft_export_dir)')
+	parser.add_argument('--no_fold', action='store_true', help='keep the BatchNorm layers instead of folding them into the convs')
+	parser.add_argument('--check', action='store_true', help='compare the exported score maps with the eager model')
+	parser.add_argument('--tolerance', default=1e-3, type=float, help='largest accepted score difference for --check')
+	args = parser.parse_args()
+	args.buckets = [tuple(int(v) for v in bucket.lower().split('x')) for bucket in args.buckets]
+	for h, w in args.buckets:
+		if h % 32 or w % 32:
+			parser.error('bucket %dx%d is not a multiple of 32' % (h, w))
+
+	model = load_model(args)
+	os.makedirs(args.export_dir, exist_ok=True)
+	for backend in args.backends:
+		for bucket in args.buckets:
+			path = os.path.join(args.export_dir, export_name(bucket, args.refine, backend))
+			EXPORTERS[backend](model, bucket, path)
+			print('exported ' + path)
+
+	if args.check and not check(model, args):
+		raise SystemExit('exported graphs differ from the eager model')
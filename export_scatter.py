@@ -0,0 +1,171 @@
+""" Export SCATTER to TorchScript and ONNX as a SCATTERInference graph (fixed decoding steps, no DataParallel).
+With --check the exported probs are compared with the eager SCATTERInference; with --benchmark the eager SCATTER
+(as OCR runs it), the eager SCATTERInference and every exported graph recognize the same crops, and the
+throughput and the agreement of their strings with eager SCATTER are reported.
+Crops are the images of --crops (e.g. a folder written by OCR.crop_boxes), or random inputs without it.
+"""
+import os
+import time
+import string
+import argparse
+import numpy as np
+import cv2
+import torch
+from ocr_config import Config
+from ocr_utils import copyStateDict, Params, fold_batchnorms_checked
+from scatter_text_recognizer import SCATTER, SCATTERInference, AttnLabelConverter, RecognizerPreprocessor, attn_greedy_decode
+
+BACKEND_EXTENSIONS = {'torchscript': '.pt', 'onnxruntime': '.onnx'}
+
+def load_model(cfg, args):
+	""" SCATTER with the weights of args.saved_model, on CPU and without the DataParallel wrapper """
+	if cfg.scatter_sensitive:
+		cfg.scatter_character = string.printable[:-6]
+	converter = AttnLabelConverter(cfg.scatter_character)
+	if cfg.scatter_rgb:
+		cfg.scatter_input_channel = 3
+	params = Params(FeatureExtraction=cfg.scatter_feature_extraction, PAD=cfg.scatter_pad,
+		batch_max_length=cfg.scatter_batch_max_length, batch_size=cfg.scatter_batch_size,
+		character=cfg.scatter_character, hidden_size=cfg.scatter_hidden_size, imgH=cfg.scatter_img_h, imgW=cfg.scatter_img_w,
+		input_channel=cfg.scatter_input_channel, num_fiducial=cfg.scatter_num_fiducial, num_gpu=cfg.scatter_num_gpu,
+		output_channel=cfg.scatter_output_channel, rgb=cfg.scatter_rgb, saved_model=args.saved_model,
+		sensitive=cfg.scatter_sensitive, workers=cfg.scatter_workers, num_class=len(converter.character))
+	scatter = SCATTER(params)
+	scatter.load_state_dict(copyStateDict(torch.load(args.saved_model, map_location='cpu')))
+	scatter.eval()
+	if not args.no_fold:
+		x = torch.rand(2, params.input_channel, params.imgH, params.imgW) * 2 - 1
+		text = torch.zeros(2, params.batch_max_length + 1, dtype=torch.long)
+		scatter = fold_batchnorms_checked(scatter, lambda model: model(x, text, is_train=False, decode_blocks=(1,)))
+	if cfg.scatter_fused_decoders:
+		scatter.fuse_decoders()  # eager SCATTER of --benchmark runs as in OCR
+	return scatter, converter
+
+def export_name(args, backend):
+	return 'scatter_%dsteps%s' % (args.num_steps, BACKEND_EXTENSIONS[backend])
+
+def export(model, x, path, backend):
+	with torch.no_grad():
+		if backend == 'torchscript':
+			torch.jit.freeze(torch.jit.trace(model, x, check_trace=False)).save(path)
+			return
+		output_names = ['probs', 'refiner'] if model.Refiner is not None else ['probs']
+		dynamic_axes = {'image': {0: 'batch'}, 'probs': {1: 'batch'}, 'refiner': {0: 'batch'}}
+		torch.onnx.export(model, x, path, input_names=['image'], output_names=output_names,
+			dynamic_axes={name: dynamic_axes[name] for name in ['image'] + output_names}, opset_version=17, dynamo=False)
+
+def load_exported(path, backend):
+	""" Return: callable on [b, c, h, w] tensors giving the exported probs [num_blocks, b, num_steps, num_classes] """
+	if backend == 'torchscript':
+		graph = torch.jit.load(path, map_location='cpu')
+		def run(x):
+			with torch.no_grad():
+				outputs = graph(x)
+			return outputs[0] if isinstance(outputs, tuple) else outputs
+		return run
+	import onnxruntime
+	session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+	return lambda x: torch.from_numpy(session.run(['probs'], {'image': x.numpy()})[0])
+
+def best_block_strings(block_preds, converter):
+	""" strings of the most confident block per crop, as in OCR.recognize_attention """
+	decoded = [attn_greedy_decode(preds) for preds in block_preds if preds is not None]
+	index, length, confidence = (torch.stack(d) for d in zip(*decoded))
+	best_block = confidence.argmax(0)
+	crops = torch.arange(index.size(1))
+	index, length = index[best_block, crops].tolist(), length[best_block, crops].tolist()
+	return [''.join(converter.character[i] for i in chars[:n]) for chars, n in zip(index, length)]
+
+def load_crops(cfg, args):
+	if args.crops is None:
+		torch.manual_seed(0)
+		return torch.rand(args.batch_size, cfg.scatter_input_channel, cfg.scatter_img_h, cfg.scatter_img_w) * 2 - 1
+	names = sorted(os.listdir(args.crops))
+	images = [cv2.imread(os.path.join(args.crops, name))[:, :, ::-1] for name in names if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png')]
+	preprocessor = RecognizerPreprocessor(cfg.scatter_img_h, cfg.scatter_img_w, cfg.scatter_pad, cfg.scatter_rgb,
+		max_batch_size=len(images), workers=cfg.scatter_workers)
+	return preprocessor(images).clone()
+
+def timed(run, batches, repeats):
+	""" Return: outputs of the first pass, ms per crop over repeats passes (after one warm-up pass) """
+	outputs = [run(x) for x in batches]
+	start = time.time()
+	for _ in range(repeats):
+		for x in batches:
+			run(x)
+	num_crops = sum(x.size(0) for x in batches) * repeats
+	return outputs, (time.time() - start) * 1000 / num_crops
+
+def benchmark(scatter, model, converter, cfg, args):
+	crops = load_crops(cfg, args)
+	batches = list(crops.split(args.batch_size))
+	text = torch.zeros(args.batch_size, args.num_steps, dtype=torch.long)
+
+	def eager_scatter(x):
+		with torch.no_grad():
+			return scatter(x, text[:x.size(0)], is_train=False, early_exit=cfg.scatter_early_exit, decode_blocks=args.decode_blocks,
+				run_refiner=False, batch_max_length=args.num_steps - 1)[0]
+
+	def eager_inference(x):
+		with torch.no_grad():
+			outputs = model(x)
+		return outputs[0] if isinstance(outputs, tuple) else outputs
+
+	runs = [('eager SCATTER', eager_scatter), ('eager SCATTERInference', eager_inference)]
+	runs += [(backend, load_exported(os.path.join(args.export_dir, export_name(args, backend)), backend)) for backend in args.backends]
+	reference = None
+	print('%d crops, batch size %d, %d threads' % (crops.size(0), args.batch_size, torch.get_num_threads()))
+	for name, run in runs:
+		outputs, ms = timed(run, batches, args.repeats)
+		strings = [s for preds in outputs for s in best_block_strings(preds, converter)]
+		if reference is None:
+			reference = strings
+		agreement = np.mean([s == r for s, r in zip(strings, reference)])
+		print('%-24s %8.3f ms/crop %8.1f crops/s   same strings as eager SCATTER: %.1f%%' % (name, ms, 1000 / ms, agreement * 100))
+
+def check(model, args, input_channel, imgH, imgW):
+	ok = True
+	x = torch.rand(3, input_channel, imgH, imgW) * 2 - 1
+	with torch.no_grad():
+		outputs = model(x)
+	reference = outputs[0] if isinstance(outputs, tuple) else outputs
+	for backend in args.backends:
+		difference = (load_exported(os.path.join(args.export_dir, export_name(args, backend)), backend)(x) - reference).abs().max().item()
+		passed = difference <= args.tolerance
+		ok = ok and passed
+		print('%-12s max |diff| %.2e\t%s' % (backend, difference, 'ok' if passed else 'FAILED'))
+	return ok
+
+if __name__ == '__main__':
+	cfg = Config()
+	parser = argparse.ArgumentParser(description='Export SCATTER to TorchScript / ONNX with a fixed-step decoder')
+	parser.add_argument('--saved_model', default=cfg.scatter_model, type=str, help='pretrained SCATTER model')
+	parser.add_argument('--num_steps', default=cfg.scatter_batch_max_length + 1, type=int, help='decoding steps, +1 for [s]')
+	parser.add_argument('--decode_blocks', nargs='+', type=int, default=None, help='blocks (1-5) whose decoders are exported, all by default')
+	parser.add_argument('--refiner', action='store_true', help='also output the CTC Refiner branch')
+	parser.add_argument('--backends', nargs='+', default=['torchscript', 'onnxruntime'], choices=sorted(BACKEND_EXTENSIONS))
+	parser.add_argument('--export_dir', default='./scatter_text_recognizer/export', type=str, help='output folder')
+	parser.add_argument('--no_fold', action='store_true', help='keep the BatchNorm layers instead of folding them into the convs')
+	parser.add_argument('--check', action='store_true', help='compare the exported probs with the eager model')
+	parser.add_argument('--tolerance', default=1e-3, type=float, help='largest accepted probs difference for --check')
+	parser.add_argument('--benchmark', action='store_true', help='compare eager and exported throughput on the same crops')
+	parser.add_argument('--crops', default=None, type=str, help='folder of crop images for --benchmark, random inputs if not set')
+	parser.add_argument('--batch_size', default=cfg.scatter_batch_size, type=int, help='crops per forward pass in --benchmark')
+	parser.add_argument('--repeats', default=3, type=int, help='timed passes over the crops in --benchmark')
+	parser.add_argument('--num_threads', default=torch.get_num_threads(), type=int, help='torch CPU threads')
+	args = parser.parse_args()
+	torch.set_num_threads(args.num_threads)
+
+	scatter, converter = load_model(cfg, args)
+	model = SCATTERInference(scatter, args.num_steps, args.decode_blocks, args.refiner).eval()
+	os.makedirs(args.export_dir, exist_ok=True)
+	x = torch.rand(2, cfg.scatter_input_channel, cfg.scatter_img_h, cfg.scatter_img_w) * 2 - 1
+	for backend in args.backends:
+		path = os.path.join(args.export_dir, export_name(args, backend))
+		export(model, x, path, backend)
+		print('exported ' + path)
+
+	if args.check and not check(model, args, cfg.scatter_input_channel, cfg.scatter_img_h, cfg.scatter_img_w):
+		raise SystemExit('exported graphs differ from the eager model')
+	if args.benchmark:
+		benchmark(scatter, model, converter, cfg, args)
@@ -2,6 +2,7 @@ import sys
 import os
 import time
 import argparse
+import math
 from scipy.signal import argrelextrema
 import torch
 import torch.nn as nn
@@ -17,7 +18,9 @@ import more_itertools as mit
 import string
 from craft_text_detector import *
 from scatter_text_recognizer import *
-from ocr_utils import copyStateDict, plot_one_box, Params, four_point_transform
+from ocr_utils import copyStateDict, plot_one_box, Params, four_point_transform, quad_crops, crop_scales, pyramid_level, image_pyramid, warp_crops, fold_batchnorms_checked
+from detection_cache import DetectionCache, model_identity
+from weight_bundle import WeightBundle
 import random
 from matplotlib import pyplot as plt
 
@@ -25,25 +28,57 @@ class OCR:
 	def __init__(self, cfg):
 		self.cfg = cfg
 		self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+		self.craft_preprocessor = imgproc.CanvasPreprocessor(cfg.craft_canvas_size, mag_ratio=cfg.craft_mag_ratio)
+		self.tile_preprocessor = None
+		if cfg.craft_tile_size:
+			self.tile_preprocessor = imgproc.CanvasPreprocessor(cfg.craft_tile_size, mag_ratio=cfg.craft_tile_mag_ratio)
+		self.detection_cache = None
+		if cfg.craft_cache_size_mb or cfg.craft_cache_dir is not None:
+			max_disk_bytes = int(cfg.craft_cache_dir_size_mb * 2**20) if cfg.craft_cache_dir_size_mb is not None else None
+			self.detection_cache = DetectionCache(int(cfg.craft_cache_size_mb * 2**20), cfg.craft_cache_dir, max_disk_bytes)
 
 	def load_net(self):
+		# a compiled weight bundle replaces the checkpoints and fixes the architecture config
+		bundle = None
+		if self.cfg.bundle_path is not None:
+			print('Loading weights from bundle (' + self.cfg.bundle_path + ')')
+			bundle = WeightBundle(self.cfg.bundle_path)
+			bundle.apply_config(self.cfg)
+
 		""" Loading detection network"""
-		self.craft = CRAFT()     # initialize
-		print('Loading box detection weights from checkpoint (' + self.cfg.craft_model + ')')
-		if self.cfg.cuda:
-			self.craft.load_state_dict(copyStateDict(torch.load(self.cfg.craft_model)))
+		if bundle is not None:
+			# built on the meta device: no random initialization, the bundle's tensors are assigned as they are
+			with torch.device('meta'):
+				self.craft = CRAFT().eval()
+			self.craft = bundle.load('craft', self.craft)
 		else:
-			self.craft.load_state_dict(copyStateDict(torch.load(self.cfg.craft_model, map_location='cpu')))
+			self.craft = CRAFT()     # initialize
+			print('Loading box detection weights from checkpoint (' + self.cfg.craft_model + ')')
+			if self.cfg.cuda:
+				self.craft.load_state_dict(copyStateDict(torch.load(self.cfg.craft_model)))
+			else:
+				self.craft.load_state_dict(copyStateDict(torch.load(self.cfg.craft_model, map_location='cpu')))
 		if self.cfg.cuda:
 			self.craft = self.craft.cuda()
 			cudnn.benchmark = False
 		
 		self.craft.eval()
+		if self.cfg.fold_batchnorm and bundle is None:
+			x = torch.randn(1, 3, 256, 256, device=next(self.craft.parameters()).device)
+			self.craft = fold_batchnorms_checked(self.craft, lambda model: model(x), self.cfg.fold_batchnorm_tolerance)
 
 		# LinkRefiner
 		self.refine_net = None
-		if self.cfg.craft_refine:
-			from refinenet import RefineNet
+		if self.cfg.craft_refine and bundle is not None:
+			from craft_text_detector.refinenet import RefineNet
+			with torch.device('meta'):
+				self.refine_net = RefineNet().eval()
+			self.refine_net = bundle.load('refine_net', self.refine_net)
+			if self.cfg.cuda:
+				self.refine_net = self.refine_net.cuda()
+			self.cfg.craft_poly = True
+		elif self.cfg.craft_refine:
+			from craft_text_detector.refinenet import RefineNet
 			self.refine_net = RefineNet()
 			print('Loading weights of refiner from checkpoint (' + self.cfg.craft_refiner_model + ')')
 			if self.cfg.cuda:
@@ -54,6 +89,13 @@ class OCR:
 				self.refine_net.load_state_dict(copyStateDict(torch.load(self.cfg.craft_refiner_model, map_location='cpu')))
 			self.refine_net.eval()
 			self.cfg.craft_poly = True
+		if self.detection_cache is not None:
+			# cached results are only valid for the weights that produced them
+			weights = [self.cfg.bundle_path] if bundle is not None else [self.cfg.craft_model,
+				self.cfg.craft_refiner_model if self.cfg.craft_refine else None]
+			self.detection_cache.model_id = model_identity(weights)
+		self.craft_backend = load_backend(self.cfg.craft_backend, CraftScoreMaps(self.craft, self.refine_net),
+			self.cfg.craft_export_dir, self.device)
 
 		""" Loading recognition network """ 
 		
@@ -61,12 +103,15 @@ class OCR:
 			self.cfg.scatter_character = string.printable[:-6]
 
 		self.scatter_converter = AttnLabelConverter(self.cfg.scatter_character)
+		self.ctc_converter = CTCLabelConverter(self.cfg.scatter_character)
 		self.cfg.scatter_num_class = len(self.scatter_converter.character)
 
 		if self.cfg.scatter_rgb:
 			self.cfg.scatter_input_channel = 3
 		
-		self.align_collate = AlignCollate(imgH=self.cfg.scatter_img_h, imgW=self.cfg.scatter_img_w, keep_ratio_with_pad=self.cfg.scatter_pad)
+		self.recognizer_preprocessor = RecognizerPreprocessor(imgH=self.cfg.scatter_img_h, imgW=self.cfg.scatter_img_w,
+			keep_ratio_with_pad=self.cfg.scatter_pad, rgb=self.cfg.scatter_rgb, max_batch_size=self.cfg.scatter_batch_size,
+			workers=self.cfg.scatter_workers, pin_memory=self.device.type == 'cuda')
 		self.scatter_params = Params(FeatureExtraction=self.cfg.scatter_feature_extraction, PAD=self.cfg.scatter_pad,
 			batch_max_length=self.cfg.scatter_batch_max_length, batch_size=self.cfg.scatter_batch_size, 
 			character=self.cfg.scatter_character, 
@@ -76,204 +121,400 @@ class OCR:
 			rgb=self.cfg.scatter_rgb, saved_model=self.cfg.scatter_model, sensitive=self.cfg.scatter_sensitive, 
 			workers=self.cfg.scatter_workers, num_class=self.cfg.scatter_num_class)
 
-		self.scatter = SCATTER(self.scatter_params)
-		self.scatter = torch.nn.DataParallel(self.scatter).to(self.device)
+		if bundle is not None:
+			with torch.device('meta'):
+				self.scatter = SCATTER(self.scatter_params).eval()
+			self.scatter = torch.nn.DataParallel(bundle.load('scatter', self.scatter)).to(self.device)
+		else:
+			self.scatter = SCATTER(self.scatter_params)
+			self.scatter = torch.nn.DataParallel(self.scatter).to(self.device)
 
-		print('loading pretrained model from %s' % self.cfg.scatter_model)
-		self.scatter.load_state_dict(torch.load(self.cfg.scatter_model, map_location=self.device))
+			print('loading pretrained model from %s' % self.cfg.scatter_model)
+			self.scatter.load_state_dict(torch.load(self.cfg.scatter_model, map_location=self.device))
 		self.scatter.eval()
-	def batch_detection(self, images, batch_size = 4):
-		
-		batch_images = []
-		for image in images:
-			if isinstance(image, str):
-				image = imgproc.loadImage(image)
-				batch_images.append(image)
-			else:
-				batch_images.append(image)
-		batch_ratios = []
-		batch_target_ratios = []
-		input_tensor = []
-		for image in batch_images:
-			img_resized, target_ratio, size_heatmap = imgproc.resize_aspect_ratio(image, self.cfg.craft_canvas_size,
-			 								interpolation=cv2.INTER_LINEAR, mag_ratio=self.cfg.craft_mag_ratio)
-			
-			batch_target_ratios.append(target_ratio)
-			ratio_h = ratio_w = 1 / target_ratio
-
-			batch_ratios.append((ratio_h, ratio_w))
-			x = imgproc.normalizeMeanVariance(img_resized)
-			x = torch.from_numpy(x).permute(2, 0, 1)
-			print(x.shape)
-			input_tensor.append(x)
-		
+		if self.cfg.fold_batchnorm and bundle is None:
+			x = torch.rand(2, self.cfg.scatter_input_channel, self.cfg.scatter_img_h, self.cfg.scatter_img_w, device=self.device) * 2 - 1
+			text = torch.zeros(2, self.cfg.scatter_batch_max_length + 1, dtype=torch.long, device=self.device)
+			self.scatter = fold_batchnorms_checked(self.scatter, lambda model: model(x, text, is_train=False, decode_blocks=(1,)),
+				self.cfg.fold_batchnorm_tolerance)
+		if self.cfg.scatter_quantize and self.device.type == 'cpu':
+			self.scatter = quantize_dynamic(self.scatter)
+		elif self.cfg.scatter_fused_decoders:
+			# the fused decoders read float weights, quantized layers keep theirs packed
+			self.scatter.module.fuse_decoders()
+	def batch_score_maps(self, images, batch_size=4, preprocessor=None):
+		""" Run CRAFT on several images with one forward pass per bucket of equally sized canvases.
+		Each image is resized as in detection() (or by preprocessor when given); canvases are grouped by their
+		32-aligned size rounded up to cfg.craft_bucket_step and padded (with the normalized value of a black
+		pixel, like the canvas padding of resize_aspect_ratio) to the bucket size.
+		With a step above 32 canvases are padded beyond their size and the score maps (and boxes) differ from detection().
+		Return: list of (score_text, score_link, target_ratio) in input order, score maps are tensors on self.device
+		"""
+		preprocessor = preprocessor or self.craft_preprocessor
+		canvas_sizes = [preprocessor.canvas_size(image) for image in images]
+
+		step = self.cfg.craft_bucket_step
+		buckets = {}
+		for i, (_, _, _, (h, w)) in enumerate(canvas_sizes):
+			buckets.setdefault((-(-h // step) * step, -(-w // step) * step), []).append(i)
+
+		results = [None] * len(images)
+		for (bucket_h, bucket_w), indices in buckets.items():
+			for start in range(0, len(indices), batch_size):
+				chunk = indices[start:start + batch_size]
+				x = preprocessor.buffer((len(chunk), 3, bucket_h, bucket_w))
+				for j, i in enumerate(chunk):
+					preprocessor.fill(images[i], x[j])
+				x = torch.from_numpy(x)
+				if self.cfg.cuda:
+					x = x.to(self.device)
+
+				score_text, score_link = self.craft_forward(x)
+
+				# slice each image's maps out of the padded bucket
+				for j, i in enumerate(chunk):
+					_, _, target_ratio, (h, w) = canvas_sizes[i]
+					results[i] = (score_text[j, :h//2, :w//2], score_link[j, :h//2, :w//2], target_ratio)
+		return results
+
+	def batch_detection(self, images, batch_size=4, return_score=True):
+		""" Batched version of detection(): images may be paths or RGB arrays of different sizes.
+		Uses the detection cache like detection(); only the misses are run through CRAFT.
+		With cfg.craft_tile_size every image goes through detection() (tiles are batched there) so both give the same results.
+		Return: lists of boxes, polys, score_text and target_ratio, one entry per input image
+		"""
+		batch_images = [imgproc.loadImage(image) if isinstance(image, str) else image for image in images]
 
-		input_tensor = torch.cat(input_tensor)
-
-		if self.cfg.cuda:
-			input_tensor = input_tensor.to(self.device)
-		
-		with torch.no_grad():
-			y, feature = self.craft(input_tensor) #CRAFT
-		
-		scores_text = y[:,:,:,0]
 		batch_boxes = []
 		batch_polys = []
-
-		for i in range(y.shape[0]):
-			score_text = y[i,:,:,0]
-			score_link = y[i,:,:,1]
-			boxes, polys = craft_utils.getDetBoxes(score_text, score_link, self.cfg.craft_text_threshold, self.cfg.craft_link_threshold,
-			self.cfg.craft_low_text, self.cfg.craft_poly)
-
-			ratio_w, ratio_h = batch_ratios[i]
-			boxes = craft_utils.adjustResultCoordinates(boxes, ratio_w, ratio_h)
-			polys = craft_utils.adjustResultCoordinates(polys, ratio_w, ratio_h)
-			for k in range(len(polys)):
-				if polys[k] is None: polys[k] = boxes[k]
+		batch_scores_text = []
+		batch_target_ratios = []
+		if self.tile_preprocessor is not None:
+			results = [self.detection(image, return_score) for image in batch_images]
+		else:
+			results = [None] * len(batch_images)
+			keys = [None] * len(batch_images)
+			if self.detection_cache is not None:
+				# hits that lack a requested score map are run again with the batch
+				for i, image in enumerate(batch_images):
+					keys[i] = self.detection_cache.key(image, self.cfg)
+					cached = self.detection_cache.get(keys[i])
+					if cached is not None and (cached[2] is not None or not return_score):
+						results[i] = cached[:2] + (cached[2] if return_score else None, cached[3])
+			misses = [i for i, result in enumerate(results) if result is None]
+			keep_score = return_score or (self.detection_cache is not None and self.cfg.craft_cache_score)
+			for i, (score_text, score_link, target_ratio) in zip(misses, self.batch_score_maps([batch_images[i] for i in misses], batch_size)):
+				boxes, polys, score_text = self.postprocess_detection(score_text, score_link, target_ratio, keep_score)
+				if self.detection_cache is not None:
+					self.detection_cache.put(keys[i], boxes, polys, score_text if self.cfg.craft_cache_score else None, target_ratio)
+				results[i] = (boxes, polys, score_text if return_score else None, target_ratio)
+		for boxes, polys, score_text, target_ratio in results:
 			batch_boxes.append(boxes)
 			batch_polys.append(polys)
-		return batch_boxes, batch_polys, scores_text, batch_target_ratios
-		
-
-		
-	
-	def detection(self, image):
-		if isinstance(image, str):
-			image = imgproc.loadImage(image)
-		t0 = time.time()
+			batch_scores_text.append(score_text)
+			batch_target_ratios.append(target_ratio)
+		return batch_boxes, batch_polys, batch_scores_text, batch_target_ratios
+
+	def craft_forward(self, x):
+		""" CRAFT (and link refiner) forward pass on cfg.craft_backend. Return: score_text, score_link tensors [b, h/2, w/2] """
+		return self.craft_backend(x)
+
+	def pack_score_maps(self, score_text, score_link):
+		""" Threshold the score maps where they live and pack them into one uint8 host map (bits in craft_utils) """
+		scoremask = (score_text > self.cfg.craft_low_text).to(torch.uint8) * craft_utils.TEXT_BIT
+		scoremask |= (score_link > self.cfg.craft_link_threshold).to(torch.uint8) * craft_utils.LINK_BIT
+		scoremask |= (score_text >= self.cfg.craft_text_threshold).to(torch.uint8) * craft_utils.STRONG_BIT
+		return scoremask.cpu().numpy()
+
+	def postprocess_detection(self, score_text, score_link, target_ratio, return_score=True):
+		""" Turn one image's CRAFT score map tensors into boxes and polys in original image coordinates.
+		With cfg.craft_threshold_on_device only the packed threshold map is copied to the host, plus the float
+		text map when return_score is set.
+		Return: boxes, polys, score_text (numpy, or None when not requested)
+		"""
+		if self.cfg.craft_threshold_on_device:
+			boxes, polys = craft_utils.getDetBoxes_packed(self.pack_score_maps(score_text, score_link), self.cfg.craft_poly)
+			score_text = score_text.cpu().data.numpy() if return_score else None
+		else:
+			score_text = score_text.cpu().data.numpy()
+			score_link = score_link.cpu().data.numpy()
+			boxes, polys = craft_utils.getDetBoxes(score_text, score_link, self.cfg.craft_text_threshold, self.cfg.craft_link_threshold,
+			 self.cfg.craft_low_text, self.cfg.craft_poly)
 
-		# resize
-		img_resized, target_ratio, size_heatmap = imgproc.resize_aspect_ratio(image, self.cfg.craft_canvas_size,
-			 								interpolation=cv2.INTER_LINEAR, mag_ratio=self.cfg.craft_mag_ratio)
+		# coordinate adjustment
 		ratio_h = ratio_w = 1 / target_ratio
+		boxes = craft_utils.adjustResultCoordinates(boxes, ratio_w, ratio_h)
+		polys = craft_utils.adjustResultCoordinates(polys, ratio_w, ratio_h)
+		for k in range(len(polys)):
+			if polys[k] is None: polys[k] = boxes[k]
+		return boxes, polys, score_text
 
-		# preprocessing
-		x = imgproc.normalizeMeanVariance(img_resized)
-		x = torch.from_numpy(x).permute(2, 0, 1)    # [h, w, c] to [c, h, w]
-		x = Variable(x.unsqueeze(0))                # [c, h, w] to [b, c, h, w]
+	def page_score_maps(self, image):
+		""" CRAFT on the page canvas of an RGB image. Return: score_text, score_link tensors [h/2, w/2], target_ratio """
+		x, target_ratio, _ = self.craft_preprocessor(image)
+		x = torch.from_numpy(x)
 		if self.cfg.cuda:
 			x = x.to(self.device)
+		score_text, score_link = self.craft_forward(x)
+		return score_text[0], score_link[0], target_ratio
+
+	def detection(self, image, return_score=True):
+		""" Detect text on an image (path or RGB array).
+		score_text and target_ratio always describe the page canvas (cfg.craft_canvas_size): with cfg.craft_tile_size the
+		boxes come from tiled_detection and, when return_score is set, score_text from an extra CRAFT pass on that canvas.
+		Return: boxes, polys (image coordinates), score_text (numpy, or None unless return_score), target_ratio
+		"""
+		if isinstance(image, str):
+			image = imgproc.loadImage(image)
+		t0 = time.time()
 
-		# forward pass
-		with torch.no_grad():
-			y, feature = self.craft(x) #CRAFT 
-
-		# make score and link map
-		score_text = y[0,:,:,0].cpu().data.numpy()
-		score_link = y[0,:,:,1].cpu().data.numpy()
-
-		# refine link
-		if self.refine_net is not None:
-			with torch.no_grad():
-				y_refiner = self.refine_net(y, feature)
-			score_link = y_refiner[0,:,:,0].cpu().data.numpy()
+		# repeated images skip CRAFT entirely, or only compute the score map when the entry has none
+		cached = None
+		if self.detection_cache is not None:
+			cache_key = self.detection_cache.key(image, self.cfg)
+			cached = self.detection_cache.get(cache_key)
+			if cached is not None and (cached[2] is not None or not return_score):
+				boxes, polys, score_text, target_ratio = cached
+				return boxes, polys, score_text if return_score else None, target_ratio
+
+		keep_score = return_score or (self.detection_cache is not None and self.cfg.craft_cache_score)
+		if cached is not None:
+			boxes, polys, _, target_ratio = cached
+			score_text = self.page_score_maps(image)[0].cpu().data.numpy()
+		elif self.tile_preprocessor is not None:
+			# large pages are detected tile by tile, the page canvas only runs for the score map
+			boxes, polys = self.tiled_detection(image)
+			target_ratio = self.craft_preprocessor.canvas_size(image)[2]
+			score_text = self.page_score_maps(image)[0].cpu().data.numpy() if keep_score else None
+		else:
+			score_text, score_link, target_ratio = self.page_score_maps(image)
+			boxes, polys, score_text = self.postprocess_detection(score_text, score_link, target_ratio, keep_score)
 
+		if self.detection_cache is not None and (cached is None or self.cfg.craft_cache_score):
+			self.detection_cache.put(cache_key, boxes, polys, score_text if self.cfg.craft_cache_score else None, target_ratio)
+		if not return_score:
+			score_text = None
 
-		# Post-processing
-		boxes, polys = craft_utils.getDetBoxes(score_text, score_link, self.cfg.craft_text_threshold, self.cfg.craft_link_threshold,
-		 self.cfg.craft_low_text, self.cfg.craft_poly)
+		return boxes, polys, score_text, target_ratio
 
-		# coordinate adjustment
-		boxes = craft_utils.adjustResultCoordinates(boxes, ratio_w, ratio_h)
-		polys = craft_utils.adjustResultCoordinates(polys, ratio_w, ratio_h)
-		for k in range(len(polys)):
-			if polys[k] is None: polys[k] = boxes[k]
+	def tiled_detection(self, image):
+		""" Detect text on overlapping fixed-size tiles instead of one canvas capped at cfg.craft_canvas_size.
+		Tiles cover cfg.craft_tile_size canvas pixels at cfg.craft_tile_mag_ratio times the image resolution and
+		overlap by cfg.craft_tile_overlap canvas pixels; at most cfg.craft_tiles_in_flight of them are on the
+		device at a time, so peak memory depends on the tile size, not on the image size.
+		Return: boxes, polys in image coordinates
+		"""
+		mag = self.cfg.craft_tile_mag_ratio
+		tile = int(self.cfg.craft_tile_size / mag)
+		stride = max(tile - int(self.cfg.craft_tile_overlap / mag), 1)
+		img_h, img_w = image.shape[:2]
+
+		def starts(length):
+			s = list(range(0, max(length - tile, 0) + 1, stride))
+			if s[-1] + tile < length:
+				s.append(length - tile)
+			return s
+		origins = [(y, x) for y in starts(img_h) for x in starts(img_w)]
+
+		# detections closer than a heatmap cell to an inner tile border may be truncated
+		margin = 2 / mag
+		all_boxes, all_polys, at_seam = [], [], []
+		in_flight = self.cfg.craft_tiles_in_flight
+		for start in range(0, len(origins), in_flight):
+			chunk = origins[start:start + in_flight]
+			tiles = [image[y:y + tile, x:x + tile] for y, x in chunk]
+			for (y, x), crop, (score_text, score_link, target_ratio) in zip(chunk, tiles,
+					self.batch_score_maps(tiles, in_flight, self.tile_preprocessor)):
+				boxes, polys, _ = self.postprocess_detection(score_text, score_link, target_ratio, return_score=False)
+				tile_h, tile_w = crop.shape[:2]
+				for box, poly in zip(boxes, polys):
+					box = (np.asarray(box) + (x, y)).astype(np.float32)
+					poly = (np.asarray(poly) + (x, y)).astype(np.float32)
+					(x0, y0), (x1, y1) = poly.min(axis=0), poly.max(axis=0)
+					at_seam.append((x > 0 and x0 <= x + margin) or (y > 0 and y0 <= y + margin)
+						or (x + tile_w < img_w and x1 >= x + tile_w - margin)
+						or (y + tile_h < img_h and y1 >= y + tile_h - margin))
+					all_boxes.append(box)
+					all_polys.append(poly)
+
+		keep = craft_utils.mergeTileBoxes(all_polys, at_seam, self.cfg.craft_tile_nms_threshold)
+		return np.array([all_boxes[i] for i in keep]), [all_polys[i] for i in keep]
 
-		return boxes, polys, score_text, target_ratio
 	def recognize(self, textbb_dict):
-
-		data = StreamDataset(self.scatter_params, textbb_dict)  # use StreamDataset
-		loader = torch.utils.data.DataLoader(
-			data, batch_size=self.scatter_params.batch_size,
-			shuffle=False,
-			num_workers=int(self.scatter_params.workers),
-			collate_fn=self.align_collate, pin_memory=True)
+		""" Recognize the crops of textbb_dict (name -> RGB numpy array or PIL image).
+		Crops are batched in order of aspect ratio so each batch holds similar widths; with
+		cfg.scatter_steps_per_aspect the decoding step budget of a batch follows its widest crop.
+		Return: predicted strings and confidence scores in the order of textbb_dict
+		"""
+		images = list(textbb_dict.values())
+		sizes = [image.size if isinstance(image, Image.Image) else image.shape[1::-1] for image in images]
+		aspect_ratios = np.array([w / max(h, 1) for w, h in sizes])
+		return self.recognize_batches(aspect_ratios, lambda batch: self.recognizer_preprocessor([images[i] for i in batch]))
+
+	def recognize_polys(self, images, polys_per_image):
+		""" Recognize the polys detected on several RGB images.
+		With cfg.scatter_direct_crops the recognizer input is sampled straight from each image for all of its polys
+		at once (ocr_utils.warp_crops), otherwise the polys are cut out with crop_boxes and go through recognize().
+		Return: predicted strings and confidence scores of all crops, number of crops per image
+		"""
+		if not self.cfg.scatter_direct_crops:
+			all_text = {}
+			num_crops = []
+			for idx, (image, polys) in enumerate(zip(images, polys_per_image)):
+				crops = self.crop_boxes(image, polys, prefix=f'{idx}_')
+				num_crops.append(len(crops))
+				all_text.update(crops)
+			pred_str, pred_conf = self.recognize(all_text)
+			return pred_str, pred_conf, num_crops
+
+		num_crops = [len(polys) for polys in polys_per_image]
+		owners = np.repeat(np.arange(len(images)), num_crops)
+		rects, sizes = quad_crops([poly for polys in polys_per_image for poly in polys])
+		channels = cv2.COLOR_RGB2GRAY if not self.cfg.scatter_rgb else None
+
+		# the same image may be passed for several sets of polys; its pyramid is built as deep as its crops need
+		# and dropped after the batch that holds its last crop, so only pages with crops still to come stay resident
+		keys = np.array([id(images[owner]) for owner in owners])
+		_, scale_x, scale_y = crop_scales(sizes, self.cfg.scatter_img_h, self.cfg.scatter_img_w, self.cfg.scatter_pad)
+		depth = pyramid_level(scale_x, scale_y) + 1
+		remaining = {key: np.count_nonzero(keys == key) for key in np.unique(keys)}
+		pyramids = {}
+
+		def fill(batch):
+			image = torch.empty(len(batch), 3 if self.cfg.scatter_rgb else 1, self.cfg.scatter_img_h, self.cfg.scatter_img_w, device=self.device)
+			for owner in np.unique(owners[batch]):
+				key = id(images[owner])
+				if key not in pyramids:
+					pixels = images[owner] if channels is None else cv2.cvtColor(images[owner], channels)[:, :, None]
+					pixels = torch.from_numpy(np.ascontiguousarray(pixels.transpose(2, 0, 1))).to(self.device).float()
+					pyramids[key] = image_pyramid(pixels, depth[keys == key].max())
+				sel = np.flatnonzero(owners[batch] == owner)
+				image[torch.from_numpy(sel).to(self.device)] = warp_crops(pyramids[key], rects[batch[sel]], sizes[batch[sel]],
+					self.cfg.scatter_img_h, self.cfg.scatter_img_w, self.cfg.scatter_pad)
+				remaining[key] -= len(sel)
+				if remaining[key] == 0:
+					del pyramids[key]
+			return image
+
+		aspect_ratios = sizes[:, 0] / np.maximum(sizes[:, 1], 1)
+		pred_str, pred_conf = self.recognize_batches(aspect_ratios, fill)
+		return pred_str, pred_conf, num_crops
+
+	def recognize_batches(self, aspect_ratios, fill):
+		""" Recognize crops in batches of similar aspect ratio.
+		fill(indices) returns the normalized SCATTER input of the crops at those indices.
+		Return: predicted strings and confidence scores in index order
+		"""
+		order = np.argsort(aspect_ratios, kind='stable')
 
 		# predict
 		
 		final_preds = []
 		final_conf = []
 		with torch.no_grad():
-			for image_tensors, image_path_list in loader:
-				all_block_preds = []
-				all_confidence_scores = []
-				batch_size = image_tensors.size(0)
-				image = image_tensors.to(self.device)
-				# For max length prediction
-				length_for_pred = torch.IntTensor([self.scatter_params.batch_max_length] * batch_size).to(self.device)
-				text_for_pred = torch.LongTensor(batch_size, self.scatter_params.batch_max_length + 1).fill_(0).to(self.device)
-
-				predss = self.scatter(image, text_for_pred, is_train=False)[0]
-				
-
-				for i, preds in enumerate(predss):
-					confidence_score_list = []
-					pred_str_list = []
-
-					# select max probability (greedy decoding) then decode index to character
-					_, preds_index = preds.max(2)
-					preds_str = self.scatter_converter.decode(preds_index, length_for_pred)
-					
-					preds_prob = F.softmax(preds, dim=2)
-					preds_max_prob, _ = preds_prob.max(dim=2)
-					for pred, pred_max_prob in zip(preds_str, preds_max_prob):
-						pred_EOS = pred.find('[s]')
-						pred = pred[:pred_EOS]  # prune after "end of sentence" token ([s])
-						pred_str_list.append(pred)
-						pred_max_prob = pred_max_prob[:pred_EOS]
-						
-						# calculate confidence score (= multiply of pred_max_prob)
-						try:
-							confidence_score = pred_max_prob.cumprod(dim=0)[-1].cpu().numpy()
-						except:
-							confidence_score = 0  # for empty pred case, when prune after "end of sentence" token ([s])
-						confidence_score_list.append(confidence_score)
-				
-					all_block_preds.append(pred_str_list)
-					all_confidence_scores.append(confidence_score_list)
-				
-				all_confidence_scores =  np.array(all_confidence_scores)
-				all_block_preds = np.array(all_block_preds)
-
-				best_pred_index = np.argmax(all_confidence_scores, axis=0)
-				best_pred_index = np.expand_dims(best_pred_index, axis=0)
+			for start in range(0, len(order), self.scatter_params.batch_size):
+				batch = order[start:start + self.scatter_params.batch_size]
+				image = fill(batch).to(self.device)
+				batch_max_length = self.scatter_params.batch_max_length
+				if self.cfg.scatter_steps_per_aspect:
+					widest = aspect_ratios[batch[-1]]
+					batch_max_length = min(batch_max_length, max(1, math.ceil(widest * self.cfg.scatter_steps_per_aspect)))
+				if self.cfg.scatter_decode_mode == 'ctc':
+					preds_str, confidence_scores = self.recognize_ctc(image)
+					# uncertain crops go through the attention decoders
+					if self.cfg.scatter_ctc_fallback_threshold is not None:
+						fallback = np.flatnonzero(confidence_scores < self.cfg.scatter_ctc_fallback_threshold)
+						if len(fallback):
+							preds_str[fallback], confidence_scores[fallback] = self.recognize_attention(
+								image[torch.from_numpy(fallback).to(self.device)], batch_max_length)
+				else:
+					preds_str, confidence_scores = self.recognize_attention(image, batch_max_length)
 
-				# Get max predition per image through blocks
-				all_block_preds = np.take_along_axis(all_block_preds, best_pred_index, axis=0)[0]
-				all_confidence_scores = np.take_along_axis(all_confidence_scores, best_pred_index, axis=0)[0]
-				
-				final_conf.extend(all_confidence_scores.tolist())
-				final_preds.extend(all_block_preds.tolist())
+				final_conf.extend(confidence_scores.tolist())
+				final_preds.extend(preds_str.tolist())
 
+		# back to the input order
+		final_preds = [final_preds[i] for i in np.argsort(order)]
+		final_conf = [final_conf[i] for i in np.argsort(order)]
 		return final_preds, final_conf
-	def batch_ocr(self, images):
-		batch_images = []
-		for image in images:
-			if isinstance(image, str):
-				image = imgproc.loadImage(image)
-				batch_images.append(image)
-			else:
-				batch_images.append(image)
-		
-		batch_bboxes, batch_polys, score_text, target_ratio = self.batch_detection(batch_images)
 
+	def recognize_attention(self, image, batch_max_length=None):
+		""" Recognize a batch of crops with the attention decoders, keeping the most confident block per crop
+		Return: arrays of predicted strings and confidence scores
+		"""
+		batch_size = image.size(0)
+		batch_max_length = batch_max_length or self.scatter_params.batch_max_length
+		# For max length prediction
+		text_for_pred = torch.LongTensor(batch_size, batch_max_length + 1).fill_(0).to(self.device)
+
+		predss = self.scatter(image, text_for_pred, is_train=False, early_exit=self.cfg.scatter_early_exit,
+			decode_blocks=self.cfg.scatter_decode_blocks, run_refiner=False,
+			cascade_threshold=self.cfg.scatter_cascade_threshold, batch_max_length=batch_max_length)[0]
+
+		# greedy decoding of every block, pruned at the first [s]; keep the most confident block per crop
+		decoded = [attn_greedy_decode(preds) for preds in predss if preds is not None]
+		if not decoded:
+			raise ValueError("cfg.scatter_decode_blocks selects no decoder, use scatter_decode_mode='ctc' to skip them all")
+		preds_index, preds_length, confidence_scores = (torch.stack(d) for d in zip(*decoded))
+		best_block = confidence_scores.argmax(0)
+		crops = torch.arange(batch_size, device=best_block.device)
+		preds_index = preds_index[best_block, crops].cpu().numpy()
+		preds_length = preds_length[best_block, crops].tolist()
+		confidence_scores = confidence_scores[best_block, crops].cpu().numpy()
+
+		# decode index to character only for the winning block
+		preds_chars = np.array(self.scatter_converter.character, dtype=object)[preds_index]
+		preds_str = np.array([''.join(chars[:length]) for chars, length in zip(preds_chars, preds_length)], dtype=object)
+		return preds_str, confidence_scores
+
+	def recognize_ctc(self, image):
+		""" Recognize a batch of crops from the CTC Refiner head alone (no contextual blocks, no attention decoding)
+		Return: arrays of predicted strings and confidence scores
+		"""
+		batch_size = image.size(0)
+		text_for_pred = torch.LongTensor(batch_size, self.scatter_params.batch_max_length + 1).fill_(0).to(self.device)
+		refiner = self.scatter(image, text_for_pred, is_train=False, decode_blocks=(), run_refiner=True)[1]
+		# the Refiner has one output per attention class, one more than the CTC alphabet; that column is never trained
+		refiner = refiner[:, :, :len(self.ctc_converter.character)]
+
+		preds_index, keep, confidence_scores = ctc_greedy_decode(refiner)
+		preds_index, keep = preds_index.cpu().numpy(), keep.cpu().numpy()
+		characters = np.array(self.ctc_converter.character, dtype=object)
+		preds_str = np.array([''.join(characters[index[k]]) for index, k in zip(preds_index, keep)], dtype=object)
+		return preds_str, confidence_scores.cpu().numpy()
+
+	def batch_ocr(self, images, batch_size=4):
+		""" Batched version of ocr(): detect text on all images, then recognize the crops of every image
+		together so SCATTER runs on full scatter_batch_size batches.
+		Return: one json list per input image, in the same format as ocr()
+		"""
+		batch_images = [imgproc.loadImage(image) if isinstance(image, str) else image for image in images]
+		_, batch_polys, _, _ = self.batch_detection([self.transform_image(image) for image in batch_images], batch_size, return_score=False)
+
+		# the crops of all images are recognized together
+		pred_str, pred_conf, num_crops = self.recognize_polys(batch_images, batch_polys)
+
+		batch_json_list = []
+		ptr = 0
+		for polys, n in zip(batch_polys, num_crops):
+			batch_json_list.append(self.format_results(polys, pred_str[ptr:ptr+n], pred_conf[ptr:ptr+n]))
+			ptr += n
+		return batch_json_list
 
-		
-	def ocr(self, image):
-		if isinstance(image, str):
-			image = imgproc.loadImage(image)
+	def transform_image(self, image):
 		if self.cfg.transform_type == "dilation":
 			kernel = np.ones(self.cfg.transform_kernel_size,np.uint8)
 			transformed_image = cv2.dilate(1 - kernel, kernel, iterations = 1)
 		else:
 			transformed_image = image.copy()
-		bboxes, polys, score_text, target_ratio = self.detection(transformed_image)
+		return transformed_image
+
+	def crop_boxes(self, image, polys, prefix=''):
+		""" Cut the detected polys out of an RGB image. Return: {box key: RGB crop} """
 		raw_img = image[:,:,::-1]
 		clone = raw_img.copy()
 		
 		all_text = {}
-		coords = []
 		for i in range(len(polys)):
 			try:
 				pts = polys[i]
@@ -301,18 +542,20 @@ class OCR:
 				p2 = max(0,int(pts[0][1]))
 				p3 = max(0,int(pts[2][0])) 
 				p4 = max(0,int(pts[2][1])) 
-				cbb = f'{p1}-{p2}_{p3}-{p4}'
+				cbb = f'{prefix}{p1}-{p2}_{p3}-{p4}'
 				# cbb  = f'{x1}-{y1}_{x2}-{y2}'
-				all_text[cbb] = Image.fromarray(cropped_box)
+				all_text[cbb] = cropped_box
 			except Exception:
 				pass
-		pred_str, pred_conf = self.recognize(all_text)
+		return all_text
+
+	def format_results(self, polys, pred_str, pred_conf):
 		json_list = []
 		for points, text, conf in zip(polys, pred_str, pred_conf):
 			word_pred_dict = {}
 			word_pred_dict['text'] = text
 			if self.cfg.craft_padding_ratio != None:
-				h = max(0,int(boxes[2][1])) - max(0,int(boxes[0][1]))
+				h = max(0,int(points[2][1])) - max(0,int(points[0][1]))
 				box_padding = int(h/self.cfg.craft_padding_ratio)
 			else:
 				box_padding =0
@@ -335,7 +578,55 @@ class OCR:
 			json_list.append(word_pred_dict)
 		
 		return json_list
+
+	def ocr(self, image):
+		if isinstance(image, str):
+			image = imgproc.loadImage(image)
+		transformed_image = self.transform_image(image)
+		bboxes, polys, _, _ = self.detection(transformed_image, return_score=False)
+		pred_str, pred_conf, _ = self.recognize_polys([image], [polys])
+		return self.format_results(polys, pred_str, pred_conf)
 		
+	def ocr_tiles_from_maps(self, image, score_text, score_link, target_ratio, tiles):
+		""" OCR the tiles of a page using the page's CRAFT score maps (tensors) instead of running CRAFT per tile.
+		tiles: list of (h0, h1, v0, v1) bounds in score map coordinates
+		The crops of all tiles are recognized together. Tiles whose mean confidence is below
+		cfg.craft_split_redetect_conf are run through ocr() again on their own.
+		Return: one json list per tile, in page coordinates
+		"""
+		scale = 2 / target_ratio    # score map to image coordinates
+		tile_polys = []
+		for t, (h0, h1, v0, v1) in enumerate(tiles):
+			polys = []
+			if h1 > h0 and v1 > v0:
+				_, polys, _ = self.postprocess_detection(score_text[h0:h1, v0:v1], score_link[h0:h1, v0:v1], target_ratio, return_score=False)
+				polys = [(np.asarray(p) + (v0 * scale, h0 * scale)).astype(np.float32) for p in polys]
+			tile_polys.append(polys)
+		pred_str, pred_conf, num_crops = self.recognize_polys([image] * len(tiles), tile_polys)
+
+		tiles_json = []
+		ptr = 0
+		for (h0, h1, v0, v1), polys, n in zip(tiles, tile_polys, num_crops):
+			confs = pred_conf[ptr:ptr+n]
+			json_list = self.format_results(polys, pred_str[ptr:ptr+n], confs)
+			ptr += n
+			if self.cfg.craft_split_redetect_conf is not None and n > 0 and np.mean(confs) < self.cfg.craft_split_redetect_conf:
+				y0, x0 = int(h0 * scale), int(v0 * scale)
+				tile = image[y0:int(h1 * scale), x0:int(v1 * scale)]
+				# a tile that is empty or cannot be resized for CRAFT keeps the result found on the page's maps
+				try:
+					redetected = self.ocr(tile.copy()) if tile.size else None
+				except cv2.error:
+					redetected = None
+				if redetected is not None:
+					json_list = redetected
+					for word in json_list:
+						for k in word:
+							if k[0] == 'x' and k[1:].isdigit(): word[k] += x0
+							if k[0] == 'y' and k[1:].isdigit(): word[k] += y0
+			tiles_json.append(json_list)
+		return tiles_json
+
 	def ocr_with_split(self, image, h_slide=10, v_slide=5): # Threshold for splitting line horizontally and vertically:
 		def consec(lst):
 			G = mit.consecutive_groups(lst)
@@ -349,7 +640,13 @@ class OCR:
 			
 
 		im_height, im_width, _ = image.shape
-		_, _, score_text, target_ratio = self.detection(image)
+		if self.cfg.craft_split_reuse_score:
+			# keep the page's score maps, tiles are detected from them instead of running CRAFT again
+			score_text, score_link, target_ratio = self.page_score_maps(image)
+			score_maps = [score_text, score_link]
+			score_text = score_text.cpu().data.numpy()
+		else:
+			_, _, score_text, target_ratio = self.detection(image)
 
 
 
@@ -372,6 +669,7 @@ class OCR:
 
 		# Split vertically on each horizontally patches
 		vertical_cut_lines = []
+		heatmap_vertical_cut_lines = []
 
 		for i in range(0,len(horizontal_cut_lines)-1):
 			patch_score = score_text[horizontal_cut_lines[i]:horizontal_cut_lines[i+1]]
@@ -390,10 +688,23 @@ class OCR:
 					vertical_patch_cut_lines.append(len(vertical_patch_score)-1)
 			
 			vertical_cut_lines.append([int(c*2*(1/target_ratio)) for c in vertical_patch_cut_lines])
+			heatmap_vertical_cut_lines.append(vertical_patch_cut_lines)
 		
 		final_json_list = []
 		# all_parts_json = []
 
+		if self.cfg.craft_split_reuse_score:
+			tiles = []
+			for i in range(0, len(horizontal_cut_lines)-1):
+				v_l = heatmap_vertical_cut_lines[i] if self.cfg.craft_split_vertically else []
+				if len(v_l)==0:
+					v_l = [0, score_text.shape[1]]
+				for j in range(len(v_l)-1):
+					tiles.append((horizontal_cut_lines[i], horizontal_cut_lines[i+1], v_l[j], v_l[j+1]))
+			for json_list in self.ocr_tiles_from_maps(image, score_maps[0], score_maps[1], target_ratio, tiles):
+				final_json_list.extend(json_list)
+			return final_json_list, final_horizontal_cut_lines, vertical_cut_lines
+
 		for i in range(0, len(final_horizontal_cut_lines)-1):
 
 			line_parts = []
@@ -478,15 +789,9 @@ class OCR:
 			image = imgproc.loadImage(image)
 		t0 = time.time()
 
-		# resize
-		img_resized, target_ratio, size_heatmap = imgproc.resize_aspect_ratio(image, self.cfg.craft_canvas_size,
-			 								interpolation=cv2.INTER_LINEAR, mag_ratio=self.cfg.craft_mag_ratio)
-		ratio_h = ratio_w = 1 / target_ratio
-
-		# preprocessing
-		x = imgproc.normalizeMeanVariance(img_resized)
-		x = torch.from_numpy(x).permute(2, 0, 1)    # [h, w, c] to [c, h, w]
-		x = Variable(x.unsqueeze(0))                # [c, h, w] to [b, c, h, w]
+		# resize and normalize into a [1, c, h, w] canvas
+		x, target_ratio, size_heatmap = self.craft_preprocessor(image)
+		x = torch.from_numpy(x)
 		if self.cfg.cuda:
 			x = x.to(self.device)
 
@@ -522,7 +827,7 @@ class OCR:
 			try:
 				split_im = image.copy()[:, final_vertical_cut_lines[i]:final_vertical_cut_lines[i+1]]
 				coor_key = '-'.join([str(final_vertical_cut_lines[i]), str(final_vertical_cut_lines[i+1])])
-				textbb_dict[coor_key] = Image.fromarray(split_im)
+				textbb_dict[coor_key] = split_im
 			except:
 				pass
 
@@ -3,6 +3,9 @@ class Config:
         
         """General config"""
         self.cuda=True
+        self.fold_batchnorm=True # fold eval-mode BatchNorm into the preceding convs of CRAFT and SCATTER at load time
+        self.fold_batchnorm_tolerance=1e-3 # folding is undone if outputs move by more than this (relative to their magnitude)
+        self.bundle_path=None # weight bundle from weight_bundle.py, replaces the checkpoints below (and the architecture fields it was compiled with)
 
         """ Config of detection module """
         self.craft_model ='./craft_text_detector/weights/craft_mlt_25k.pth'
@@ -18,8 +21,23 @@ class Config:
         # self.craft_show_time=False
         self.craft_refine=False
         self.craft_refiner_model='./craft_text_detector/weights/craft_refiner_CTW1500.pth'
+        self.craft_threshold_on_device = True # threshold score maps before copying them to the host (one packed uint8 map)
+        self.craft_cache_size_mb = 0 # in-memory LRU of detection results keyed by image content and detection config, 0 disables
+        self.craft_cache_dir = None # optional on-disk tier of the detection cache (.npz files)
+        self.craft_cache_dir_size_mb = 1024 # the disk tier drops its least recently used entries beyond this size, None keeps them all
+        self.craft_cache_score = False # also cache score_text, so hits of detection(return_score=True) skip the page canvas pass; only callers that need score maps (ocr_with_split with craft_split_reuse_score=False) benefit
+        self.craft_tile_size = None # detect on overlapping tiles of this canvas size instead of one down-scaled canvas, None disables
+        self.craft_tile_mag_ratio = 1.0 # tile magnification relative to the original image
+        self.craft_tile_overlap = 128 # tile overlap in canvas pixels, should exceed the longest expected word
+        self.craft_tiles_in_flight = 4 # tiles batched through CRAFT at a time, bounds peak memory
+        self.craft_tile_nms_threshold = 0.5 # drop tile detections covered by a kept one by more than this fraction of the smaller box
+        self.craft_backend = 'eager' # 'eager', 'torchscript' or 'onnxruntime' (CPU), the latter two run graphs from export_craft.py
+        self.craft_export_dir = './craft_text_detector/export' # exported CRAFT graphs, one per canvas bucket
+        self.craft_bucket_step = 32 # batch_detection groups canvases whose sizes match after rounding up to this step; at 32 (the canvas alignment) no canvas is padded and boxes equal detection()'s, larger steps pad canvases into fewer, fuller batches and trade that equivalence for throughput (the padding changes the score maps, and so the boxes)
         self.craft_padding_ratio = None # Extend detected boxes generated from CRAFT. Each box will be add "box_height/craft_padding_ratio" both sides
         self.craft_split_vertically = True
+        self.craft_split_reuse_score = False # ocr_with_split detects tiles from the page's score maps instead of re-running CRAFT per tile; faster, but tiles are no longer re-detected at their own resolution (nor passed through transform_image), so results differ
+        self.craft_split_redetect_conf = None # with craft_split_reuse_score, tiles whose mean confidence is below this are re-detected on their own
         self.box_type = 'rectangle'
         # self.transform_type =  'dilation' 
         self.transform_type =  None 
@@ -30,6 +48,14 @@ class Config:
         self.scatter_pad=False
         self.scatter_batch_max_length=35
         self.scatter_batch_size=192
+        self.scatter_early_exit=True # stop decoding a batch once every sequence emitted [s]
+        self.scatter_steps_per_aspect=None # decoding steps per unit of crop aspect ratio (w/h); a batch decodes up to its widest crop's budget, capped at scatter_batch_max_length. None always uses scatter_batch_max_length
+        self.scatter_decode_blocks=None # numbers (1-5) of the SCATTER blocks whose decoders run at inference, e.g. (5,); None runs all
+        self.scatter_cascade_threshold=None # decode blocks in order and stop for a crop once a block's confidence reaches this, None decodes all
+        self.scatter_fused_decoders=True # step the five block decoders in lockstep with batched matmuls when all of them are decoded
+        self.scatter_quantize=False # dynamic int8 quantization of SCATTER's LSTM/LSTMCell/Linear layers, CPU only (disables scatter_fused_decoders)
+        self.scatter_decode_mode='attention' # 'attention' or 'ctc' (greedy CTC decoding of the Refiner head only)
+        self.scatter_ctc_fallback_threshold=None # in ctc mode, crops whose confidence is below this are re-recognized with the attention decoders
         self.scatter_character= '0123456789abcdefghijklmnopqrstuvwxyz'
         self.scatter_hidden_size=512
         self.scatter_img_h=32
@@ -40,7 +66,8 @@ class Config:
         self.scatter_output_channel=512
         self.scatter_rgb=False
         self.scatter_sensitive=True
-        self.scatter_workers=4
+        self.scatter_workers=4 # threads of the recognizer preprocessing pool, 0 preprocesses in the calling thread
+        self.scatter_direct_crops=False # sample recognizer inputs straight from the page for all boxes at once instead of cutting out full-resolution crops; inputs differ slightly from the crops (off until its accuracy is measured)
         # self.scatter_model='./scatter_text_recognizer/weights/scatter-case-sensitive-ori.pth'
         self.scatter_model='./scatter_text_recognizer/weights/scatter-case-sensitive-retrain.pth'
 
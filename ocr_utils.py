@@ -3,6 +3,11 @@ from collections import OrderedDict
 import math
 import scipy.spatial.distance as distance
 import numpy as np
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 class Params:
 	def __init__(self, **kwargs):
 		self.__dict__.update(kwargs)
@@ -18,6 +23,52 @@ def copyStateDict(state_dict):
 		new_state_dict[name] = v
 	return new_state_dict
 
+def fold_batchnorms(model):
+	""" Fold eval-mode BatchNorm2d layers into the Conv2d that feeds them, in place; the BatchNorms become Identity.
+	Pairs are a Conv2d directly followed by a BatchNorm2d in a Sequential, and sibling convX / bnX attributes
+	(the ResNet naming), which assumes forward() applies bnX right after convX: use fold_batchnorms_checked.
+	Return: number of folded pairs
+	"""
+	folded = 0
+	for module in model.modules():
+		children = dict(module.named_children())
+		pairs = []
+		if isinstance(module, nn.Sequential):
+			names = list(children)
+			pairs = list(zip(names[:-1], names[1:]))
+		else:
+			pairs = [('conv' + name[2:], name) for name in children if name.startswith('bn')]
+		for conv_name, bn_name in pairs:
+			conv, bn = children.get(conv_name), children.get(bn_name)
+			if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d) and bn.track_running_stats:
+				setattr(module, conv_name, fuse_conv_bn_eval(conv, bn))
+				setattr(module, bn_name, nn.Identity())
+				children[bn_name] = None    # a BatchNorm is folded once
+				folded += 1
+	return folded
+
+def fold_batchnorms_checked(model, run, tolerance=1e-3):
+	""" fold_batchnorms on a copy of an eval-mode model, kept only if run(model) gives the same outputs
+	(tensors or nested tuples/lists of them) within tolerance, relative to the largest output magnitude.
+	Return: the folded copy, or model unchanged
+	"""
+	folded_model = copy.deepcopy(model)
+	if fold_batchnorms(folded_model) == 0:
+		return model
+
+	def flatten(outputs):
+		if isinstance(outputs, (tuple, list)):
+			return [t for o in outputs for t in flatten(o)]
+		return [] if outputs is None else [outputs]
+
+	with torch.no_grad():
+		reference, outputs = flatten(run(model)), flatten(run(folded_model))
+	for r, o in zip(reference, outputs):
+		if r.shape != o.shape or (r - o).abs().max() > tolerance * max(1.0, r.abs().max().item()):
+			print('BatchNorm folding changed the outputs, keeping the original model')
+			return model
+	return folded_model
+
 # def str2bool(v):
 # 	return v.lower() in ("yes", "y", "true", "t", "1")
 
@@ -151,6 +202,105 @@ def four_point_transform(image, pts):
 	# return the warped image
 	return warped
 
+def quad_crops(polys):
+	""" The corner ordering and crop size of four_point_transform for many polys at once.
+	Return: ordered corners (tl, tr, br, bl) [N x 4 x 2] and crop sizes (maxWidth, maxHeight) [N x 2]
+	"""
+	rects = np.array([order_points(np.asarray(p, dtype=np.float32)) for p in polys], dtype=np.float32).reshape(-1, 4, 2)
+	tl, tr, br, bl = rects.transpose(1, 0, 2)
+	widths = np.maximum(np.linalg.norm(br - bl, axis=1), np.linalg.norm(tr - tl, axis=1)).astype(int)
+	heights = np.maximum(np.linalg.norm(tr - br, axis=1), np.linalg.norm(tl - bl, axis=1)).astype(int)
+	return rects, np.stack([widths, heights], 1)
+
+def crop_scales(sizes, imgH=32, imgW=100, keep_ratio_with_pad=False):
+	""" Width each crop is resized to (before AlignCollate padding) and its crop pixels per output pixel on each axis.
+	Return: resized_w, scale_x, scale_y [N]
+	"""
+	w = np.maximum(sizes[:, 0], 2).astype(np.float64)
+	h = np.maximum(sizes[:, 1], 2).astype(np.float64)
+	resized_w = np.full(len(sizes), imgW, dtype=np.float64)
+	if keep_ratio_with_pad:
+		resized_w = np.minimum(imgW, np.ceil(imgH * sizes[:, 0] / np.maximum(sizes[:, 1], 1)))
+		resized_w = np.maximum(resized_w, 1)
+	return resized_w, w / resized_w, h / imgH
+
+def pyramid_level(scale_x, scale_y):
+	""" image_pyramid level warp_crops samples a crop from: the one that takes out the smaller of its two scales """
+	return np.floor(np.log2(np.maximum(np.minimum(scale_x, scale_y), 1))).astype(int)
+
+def image_pyramid(image, num_levels=None, min_size=8):
+	""" Area-averaged 2x reductions of an image [C x H x W]: level l is the mean of 2^l x 2^l pixel blocks.
+	Levels stop at num_levels or when a side would fall below min_size. Return: list of levels, level 0 is image itself
+	"""
+	levels = [image]
+	while (num_levels is None or len(levels) < num_levels) and min(levels[-1].shape[1:]) >= 2 * min_size:
+		levels.append(F.avg_pool2d(levels[-1].unsqueeze(0), 2, ceil_mode=True).squeeze(0))
+	return levels
+
+def warp_crops(image, rects, sizes, imgH=32, imgW=100, keep_ratio_with_pad=False, max_taps=4):
+	""" Sample quads of an image straight to recognizer input.
+	Each output approximates four_point_transform of the quad resized to imgW x imgH (or, with keep_ratio_with_pad,
+	to the AlignCollate width and border padded): the perspective warp and the resize are composed into one
+	homography per quad, so the cost does not depend on box area. Downscaled quads are prefiltered: they are
+	sampled from the image_pyramid level of their smaller scale factor, and the scale left on each axis is
+	averaged over up to max_taps bilinear taps per output pixel, so large boxes do not alias.
+	image: float tensor [C x H x W] with values in 0-255, or its image_pyramid
+	rects, sizes: from quad_crops
+	Return: tensor [N x C x imgH x imgW] normalized to [-1, 1] like AlignCollate
+	"""
+	levels = image if isinstance(image, (list, tuple)) else [image]
+	n = len(rects)
+	device = levels[0].device
+	w = np.maximum(sizes[:, 0], 2).astype(np.float64)
+	h = np.maximum(sizes[:, 1], 2).astype(np.float64)
+	resized_w, scale_x, scale_y = crop_scales(sizes, imgH, imgW, keep_ratio_with_pad)
+
+	# homographies from crop to image coordinates (the inverse of getPerspectiveTransform(rect, dst)), all solved at once
+	zeros, ones = np.zeros(n), np.ones(n)
+	x = np.stack([zeros, w - 1, w - 1, zeros], 1)
+	y = np.stack([zeros, zeros, h - 1, h - 1], 1)
+	X, Y = rects[:, :, 0].astype(np.float64), rects[:, :, 1].astype(np.float64)
+	zeros4, ones4 = np.zeros_like(x), np.ones_like(x)
+	A = np.concatenate([np.stack([x, y, ones4, zeros4, zeros4, zeros4, -x * X, -y * X], 2),
+		np.stack([zeros4, zeros4, zeros4, x, y, ones4, -x * Y, -y * Y], 2)], 1)
+	b = np.concatenate([X, Y], 1)[:, :, None]
+	M = np.concatenate([(np.linalg.pinv(A) @ b)[:, :, 0], ones[:, None]], 1).reshape(n, 3, 3)
+
+	# pyramid level of each crop and the taps left per axis
+	level = np.minimum(pyramid_level(scale_x, scale_y), len(levels) - 1)
+	taps_x = np.clip(np.round(scale_x / 2.0**level), 1, max_taps).astype(int)
+	taps_y = np.clip(np.round(scale_y / 2.0**level), 1, max_taps).astype(int)
+
+	def as_tensor(a):
+		return torch.as_tensor(a, dtype=torch.float32, device=device)
+	crops = torch.empty(n, levels[0].size(0), imgH, imgW, device=device)
+	u = torch.arange(imgW, dtype=torch.float32, device=device)
+	v = torch.arange(imgH, dtype=torch.float32, device=device)
+	groups = np.stack([level, taps_x, taps_y], 1)
+	for l, kx, ky in np.unique(groups, axis=0):
+		sel = np.flatnonzero((groups == (l, kx, ky)).all(1))
+
+		# output pixel centers -> crop coordinates (as cv2.resize maps them), columns past resized_w repeat the last one;
+		# each center is spread into kx x ky taps evenly covering its footprint in the crop
+		rw = as_tensor(resized_w[sel])[:, None, None]
+		sx, sy = as_tensor(scale_x[sel])[:, None, None], as_tensor(scale_y[sel])[:, None, None]
+		tx = ((torch.arange(kx, dtype=torch.float32, device=device) + 0.5) / kx - 0.5)[None, None]
+		ty = ((torch.arange(ky, dtype=torch.float32, device=device) + 0.5) / ky - 0.5)[None, None]
+		cx = ((torch.min(u[None, :, None], rw - 1) + 0.5 + tx) * sx - 0.5).reshape(len(sel), 1, imgW * kx)
+		cy = ((v[None, :, None] + 0.5 + ty) * sy - 0.5).reshape(len(sel), imgH * ky, 1)
+
+		# crop -> image pixel coordinates -> grid_sample's [-1, 1] over the extent the level covers (align_corners=False),
+		# outside the image is black as in warpPerspective
+		page = levels[l]
+		hom = as_tensor(M[sel])[:, :, :, None, None]
+		den = hom[:, 2, 0] * cx + hom[:, 2, 1] * cy + hom[:, 2, 2]
+		gx = (hom[:, 0, 0] * cx + hom[:, 0, 1] * cy + hom[:, 0, 2]) / den * (2.0 / (page.size(2) * 2**l)) + (1.0 / (page.size(2) * 2**l) - 1)
+		gy = (hom[:, 1, 0] * cx + hom[:, 1, 1] * cy + hom[:, 1, 2]) / den * (2.0 / (page.size(1) * 2**l)) + (1.0 / (page.size(1) * 2**l) - 1)
+		samples = F.grid_sample(page.unsqueeze(0).expand(len(sel), -1, -1, -1), torch.stack([gx, gy], 3),
+			mode='bilinear', padding_mode='zeros', align_corners=False)
+		crops[torch.from_numpy(sel).to(device)] = F.avg_pool2d(samples, (int(ky), int(kx))) if kx * ky > 1 else samples
+	return crops.mul_(2 / 255.).sub_(1)
+
 if __name__ == '__main__':
 
 	# points = [['11/10,', 
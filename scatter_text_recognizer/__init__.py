@@ -1,3 +1,3 @@
-from .model import SCATTER
-from .dataset import StreamDataset, AlignCollate
-from .utils import AttnLabelConverter
\ No newline at end of file
+from .model import SCATTER, SCATTERInference
+from .dataset import StreamDataset, AlignCollate, RecognizerPreprocessor
+from .utils import AttnLabelConverter, CTCLabelConverter, attn_greedy_decode, ctc_greedy_decode, quantize_dynamic
\ No newline at end of file
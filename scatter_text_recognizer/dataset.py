@@ -4,7 +4,9 @@ import re
 import six
 import math
 import lmdb
+import cv2
 import torch
+from concurrent.futures import ThreadPoolExecutor
 
 from natsort import natsorted
 from PIL import Image
@@ -301,6 +303,61 @@ class StreamDataset(Dataset):
             img = self.image_list[index].convert('L')
         return (img, self.image_bb[index])
 
+class RecognizerPreprocessor(object):
+    """ Inference replacement for StreamDataset + AlignCollate: resizes and normalizes crops with OpenCV
+    straight into a preallocated [max_batch_size x C x imgH x imgW] tensor, on a thread pool that lives as
+    long as the preprocessor. Crops are RGB or gray numpy arrays, or PIL images.
+    The returned tensor is a view of that buffer and is overwritten by the next call.
+    """
+
+    def __init__(self, imgH=32, imgW=100, keep_ratio_with_pad=False, rgb=False, max_batch_size=192, workers=4,
+                 pin_memory=False):
+        self.imgH = imgH
+        self.imgW = imgW
+        self.keep_ratio_with_pad = keep_ratio_with_pad
+        self.rgb = rgb
+        self.buffer = torch.empty(max_batch_size, 3 if rgb else 1, imgH, imgW)
+        if pin_memory and torch.cuda.is_available():  # pinning needs a CUDA driver
+            self.buffer = self.buffer.pin_memory()
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    def __call__(self, images):
+        assert len(images) <= self.buffer.size(0), 'batch larger than max_batch_size'
+        batch = self.buffer[:len(images)]
+        if self.pool is None:
+            for image, out in zip(images, batch.numpy()):
+                self.fill(image, out)
+        else:
+            list(self.pool.map(self.fill, images, batch.numpy()))
+        return batch
+
+    def fill(self, image, out):
+        """ Write one crop into out [C x imgH x imgW] """
+        if isinstance(image, Image.Image):
+            image = np.asarray(image.convert('RGB' if self.rgb else 'L'))
+        elif self.rgb and image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        elif not self.rgb and image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+        h, w = image.shape[:2]
+        resized_w = self.imgW
+        if self.keep_ratio_with_pad:  # same as AlignCollate
+            resized_w = min(self.imgW, math.ceil(self.imgH * w / float(h)))
+        # area averaging when shrinking stands in for the antialiasing of PIL's bicubic resize
+        interpolation = cv2.INTER_AREA if resized_w * self.imgH < w * h else cv2.INTER_CUBIC
+        resized = cv2.resize(image, (resized_w, self.imgH), interpolation=interpolation)
+        if resized.ndim == 2:
+            resized = resized[:, :, None]
+
+        # ToTensor and sub_(0.5).div_(0.5) in one pass, then the border padding of NormalizePAD
+        np.multiply(resized.transpose(2, 0, 1), 2 / 255., out=out[:, :, :resized_w], casting='unsafe')
+        out[:, :, :resized_w] -= 1
+        if resized_w < self.imgW:
+            out[:, :, resized_w:] = out[:, :, resized_w - 1:resized_w]
+        return out
+
+
 class AlignCollate(object):
 
     def __init__(self, imgH=32, imgW=100, keep_ratio_with_pad=False):
@@ -4,11 +4,14 @@ Author: Trong-Dat Phan
 from __future__ import absolute_import
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from .modules.transformation import TPS_SpatialTransformerNetwork
 from .modules.feature_extraction import ResNet_FeatureExtractor
 from .modules.sequence_modeling import BidirectionalLSTM
 from .modules.visual_feature_refinement import Refinement
 from .modules.selective_contextual_refinement_block import SelectiveContextualRefinementBlock
+from .modules.fused_decoder import FusedSelectiveDecoders
+from .utils import attn_greedy_decode
 
 class SCATTER(nn.Module):
 
@@ -35,9 +38,20 @@ class SCATTER(nn.Module):
         self.ctx_block3 = SelectiveContextualRefinementBlock(self.FeatureExtraction_output, opt.hidden_size, opt.num_class)
         self.ctx_block4 = SelectiveContextualRefinementBlock(self.FeatureExtraction_output, opt.hidden_size, opt.num_class)
         self.ctx_block5 = SelectiveContextualRefinementBlock(self.FeatureExtraction_output, opt.hidden_size, opt.num_class)
+
+        self.fused_decoders = None  # see fuse_decoders
         
 
-    def forward(self, input, attn_text, is_train=True):
+    def forward(self, input, attn_text, is_train=True, early_exit=False, decode_blocks=None, run_refiner=True,
+                cascade_threshold=None, batch_max_length=None):
+        """
+        batch_max_length : decoding step budget of this batch, opt.batch_max_length by default.
+        decode_blocks : numbers (1-5) of the contextual refinement blocks whose decoders run, None for all.
+            Sequence modeling still runs up to the last requested block; skipped predictions are None.
+            An empty sequence skips the contextual blocks altogether (CTC-only inference).
+        run_refiner : run the CTC Refinement branch, otherwise its output is None.
+        cascade_threshold : at inference, run the blocks as a cascade (see cascade) and return its single prediction.
+        """
         """ Transformation stage """
         input = self.Transformation(input)
 
@@ -48,13 +62,150 @@ class SCATTER(nn.Module):
         visual_feature = visual_feature.squeeze(3)
 
         """ Refinement branch """
-        refiner = self.Refiner(visual_feature.contiguous())
+        refiner = self.Refiner(visual_feature.contiguous()) if run_refiner else None
 
         # Selective Contextual Refinement Block 
-        contextual_feature, block_pred1 = self.ctx_block1(visual_feature, visual_feature, attn_text, is_train, self.opt.batch_max_length)
-        contextual_feature, block_pred2 = self.ctx_block2(visual_feature, contextual_feature, attn_text, is_train, self.opt.batch_max_length)
-        contextual_feature, block_pred3 = self.ctx_block3(visual_feature, contextual_feature, attn_text, is_train, self.opt.batch_max_length)
-        contextual_feature, block_pred4 = self.ctx_block4(visual_feature, contextual_feature, attn_text, is_train, self.opt.batch_max_length)
-        _, block_pred5 = self.ctx_block5(visual_feature, contextual_feature, attn_text, is_train, self.opt.batch_max_length)
+        if batch_max_length is None:
+            batch_max_length = self.opt.batch_max_length
+        blocks = (self.ctx_block1, self.ctx_block2, self.ctx_block3, self.ctx_block4, self.ctx_block5)
+        if decode_blocks is None:
+            decode_blocks = range(1, len(blocks) + 1)
+        if cascade_threshold is not None:
+            return (self.cascade(visual_feature, attn_text, cascade_threshold, decode_blocks, early_exit, batch_max_length),), refiner
+
+        if self.fused_decoders is not None and not is_train and set(decode_blocks) == set(range(1, len(blocks) + 1)):
+            return self.fused_forward(visual_feature, early_exit, batch_max_length), refiner
+
+        block_preds = [None] * len(blocks)
+        contextual_feature = visual_feature
+        for k, block in enumerate(blocks[:max(decode_blocks, default=0)], 1):
+            contextual_feature, block_preds[k - 1] = block(visual_feature, contextual_feature, attn_text, is_train,
+                batch_max_length, early_exit, decode=k in decode_blocks)
+
+        return tuple(block_preds), refiner
+
+    def cascade(self, visual_feature, attn_text, threshold, decode_blocks, early_exit=False, batch_max_length=None):
+        """ Decode block by block; a sample leaves the cascade once a block's confidence reaches threshold,
+        so only uncertain samples pay for the later BiLSTM stacks and decoders.
+        output: for each sample, the prediction of its most confident decoded block
+            (the one that passed the threshold, if any). [batch_size x num_steps x num_classes]
+            None when decode_blocks is empty, like the skipped predictions of forward.
+        """
+        if batch_max_length is None:
+            batch_max_length = self.opt.batch_max_length
+        blocks = (self.ctx_block1, self.ctx_block2, self.ctx_block3, self.ctx_block4, self.ctx_block5)
+        batch_size = visual_feature.size(0)
+        active = torch.arange(batch_size, device=visual_feature.device)
+        best_preds = None
+        best_confidence = visual_feature.new_full((batch_size,), -1)
+
+        contextual_feature = visual_feature
+        for k, block in enumerate(blocks[:max(decode_blocks, default=0)], 1):
+            contextual_feature, block_pred = block(visual_feature, contextual_feature, attn_text[active], False,
+                batch_max_length, early_exit, decode=k in decode_blocks)
+            if block_pred is None:
+                continue
+
+            _, _, confidence = attn_greedy_decode(block_pred)
+            if best_preds is None:
+                best_preds = block_pred.new_zeros((batch_size,) + block_pred.shape[1:])
+            better = confidence > best_confidence[active]
+            best_preds[active[better]] = block_pred[better]
+            best_confidence[active[better]] = confidence[better]
+
+            running = confidence < threshold
+            if not running.any():
+                break
+            active = active[running]
+            visual_feature = visual_feature[running]
+            contextual_feature = contextual_feature[running]
+
+        return best_preds
+
+    def fuse_decoders(self):
+        """ Stack the weights of the five selective decoders for lockstep inference (see FusedSelectiveDecoders).
+        Call after loading weights; the stacked copies are buffers, so later .to() / .half() calls move them too.
+        """
+        blocks = (self.ctx_block1, self.ctx_block2, self.ctx_block3, self.ctx_block4, self.ctx_block5)
+        self.fused_decoders = FusedSelectiveDecoders([block.selective_decoder for block in blocks])
+
+    def fused_forward(self, visual_feature, early_exit=False, batch_max_length=None):
+        """ Run the BiLSTM stacks in order, then the five decoders in one lockstep loop """
+        blocks = (self.ctx_block1, self.ctx_block2, self.ctx_block3, self.ctx_block4, self.ctx_block5)
+        decoder_inputs = []
+        contextual_feature = visual_feature
+        for block in blocks:
+            contextual_feature = block.sequence_modeling(contextual_feature)
+            decoder_inputs.append(torch.cat((contextual_feature, visual_feature), 2))
+        if batch_max_length is None:
+            batch_max_length = self.opt.batch_max_length
+        block_preds = self.fused_decoders(torch.stack(decoder_inputs), batch_max_length, early_exit)
+        return tuple(block_preds.unbind(0))
+
+
+class SCATTERInference(nn.Module):
+    """ Export-ready inference graph of a loaded SCATTER (TorchScript tracing / ONNX).
+    The attention decoders run greedily for a fixed num_steps into a preallocated buffer, with no early exit
+    and no data-dependent control flow, so the traced graph holds for any batch size. Steps after [s] are
+    decoded anyway; attn_greedy_decode ignores them. Modules are shared with scatter (unwrap DataParallel first).
+    output: probs of the decoded blocks [num_blocks x batch_size x num_steps x num_classes],
+        plus the Refiner (CTC) output when run_refiner is set
+    """
+
+    def __init__(self, scatter, num_steps=None, decode_blocks=None, run_refiner=False):
+        super(SCATTERInference, self).__init__()
+        blocks = (scatter.ctx_block1, scatter.ctx_block2, scatter.ctx_block3, scatter.ctx_block4, scatter.ctx_block5)
+        if decode_blocks is None:
+            decode_blocks = range(1, len(blocks) + 1)
+        self.decode_blocks = sorted(decode_blocks)
+        self.num_steps = num_steps or scatter.opt.batch_max_length + 1  # +1 for [s]
+        self.Transformation = scatter.Transformation
+        self.FeatureExtraction = scatter.FeatureExtraction
+        self.Refiner = scatter.Refiner if run_refiner else None
+        self.blocks = nn.ModuleList(blocks[:max(self.decode_blocks)])
+
+    def decode(self, decoder, D):
+        """ fixed-step greedy decoding of one SelectiveDecoder. D : [batch_size x T x input_size] """
+        attention = decoder.second_attention
+        cell = attention.attention_cell
+        D = D * decoder.first_attention(D)
+        D_proj = cell.i2h(D)
+        onehots = torch.eye(attention.num_classes, dtype=D.dtype, device=D.device)
+
+        rnn = cell.rnn
+        probs = D.new_zeros(D.size(0), self.num_steps, attention.num_classes)
+        h = D.new_zeros(D.size(0), attention.hidden_size)
+        c = D.new_zeros(D.size(0), attention.hidden_size)
+        char_onehots = onehots[0].expand(D.size(0), -1)  # [GO] token
+        for i in range(self.num_steps):
+            # AttentionCell.forward with the LSTMCell spelled out (ONNX cannot export lstm_cell with a dynamic batch)
+            alpha = F.softmax(cell.score(torch.tanh(D_proj + cell.h2h(h).unsqueeze(1))), dim=1)
+            context = torch.bmm(alpha.permute(0, 2, 1), D).squeeze(1)
+            gates = F.linear(torch.cat([context, char_onehots], 1), rnn.weight_ih, rnn.bias_ih) \
+                + F.linear(h, rnn.weight_hh, rnn.bias_hh)
+            in_gate, forget_gate, cell_gate, out_gate = gates.view(-1, 4, attention.hidden_size).unbind(1)
+            c = torch.sigmoid(forget_gate) * c + torch.sigmoid(in_gate) * torch.tanh(cell_gate)
+            h = torch.sigmoid(out_gate) * torch.tanh(c)
+            probs_step = attention.generator(h)
+            probs[:, i, :] = probs_step
+            char_onehots = onehots[probs_step.argmax(1)]
+        return probs
+
+    def forward(self, input):
+        input = self.Transformation(input)
+        visual_feature = self.FeatureExtraction(input)
+        # AdaptiveAvgPool2d((None, 1)) of SCATTER, written as a mean: ONNX has no adaptive pooling with a free axis
+        visual_feature = visual_feature.permute(0, 3, 1, 2).mean(3)  # [b, c, h, w] -> [b, w, c]
+
+        block_preds = []
+        contextual_feature = visual_feature
+        for k, block in enumerate(self.blocks, 1):
+            contextual_feature = block.sequence_modeling(contextual_feature)
+            if k in self.decode_blocks:
+                D = torch.cat((contextual_feature, visual_feature), 2)
+                block_preds.append(self.decode(block.selective_decoder, D))
+        probs = torch.stack(block_preds)
 
-        return (block_pred1, block_pred2, block_pred3, block_pred4, block_pred5), refiner
+        if self.Refiner is not None:
+            return probs, self.Refiner(visual_feature.contiguous())
+        return probs
@@ -0,0 +1,103 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class FusedSelectiveDecoders(nn.Module):
+    """ Inference-only lockstep execution of several SelectiveDecoders.
+    The weights of the decoders are stacked along a leading head dimension so one greedy decoding loop
+    advances all heads with batched matmuls. The stacked tensors are non-persistent buffers: they follow
+    .to() / .half() and DataParallel replication but never reach the state_dict. They are copies, so build
+    it after the weights are loaded (and rebuild it if they change).
+    """
+
+    def __init__(self, decoders):
+        super(FusedSelectiveDecoders, self).__init__()
+
+        def stack(get):
+            return torch.stack([get(d).detach() for d in decoders])
+
+        def buffer(name, tensor):
+            self.register_buffer(name, tensor, persistent=False)
+
+        buffer('first_attention_weight', stack(lambda d: d.first_attention.weight.t()))  # heads x in x in
+        buffer('first_attention_bias', stack(lambda d: d.first_attention.bias).unsqueeze(1))
+
+        attention = [d.second_attention for d in decoders]
+        self.num_classes = attention[0].num_classes
+        self.hidden_size = attention[0].hidden_size
+        self.eos_index = attention[0].eos_index
+        input_size = decoders[0].first_attention.in_features
+
+        buffer('i2h_weight', stack(lambda d: d.second_attention.attention_cell.i2h.weight.t()))
+        buffer('i2h_bias', stack(lambda d: d.second_attention.attention_cell.i2h.bias).unsqueeze(1))
+        buffer('h2h_weight', stack(lambda d: d.second_attention.attention_cell.h2h.weight.t()))
+        buffer('h2h_bias', stack(lambda d: d.second_attention.attention_cell.h2h.bias).unsqueeze(1))
+        buffer('score_weight', stack(lambda d: d.second_attention.attention_cell.score.weight.t()))  # heads x hidden x 1
+
+        # LSTMCell input is cat([context, onehot]): split its weight so the one-hot product becomes a column lookup
+        w_ih = stack(lambda d: d.second_attention.attention_cell.rnn.weight_ih)
+        buffer('rnn_context_weight', w_ih[:, :, :input_size].transpose(1, 2).contiguous())  # heads x in x 4*hidden
+        buffer('rnn_embedding', w_ih[:, :, input_size:].transpose(1, 2).contiguous())  # heads x num_classes x 4*hidden
+        buffer('rnn_hidden_weight', stack(lambda d: d.second_attention.attention_cell.rnn.weight_hh.t()))
+        buffer('rnn_bias', stack(lambda d: d.second_attention.attention_cell.rnn.bias_ih
+                                 + d.second_attention.attention_cell.rnn.bias_hh).unsqueeze(1))
+
+        buffer('generator_weight', stack(lambda d: d.second_attention.generator.weight.t()))
+        buffer('generator_bias', stack(lambda d: d.second_attention.generator.bias).unsqueeze(1))
+
+    def forward(self, D, batch_max_length=25, early_exit=False):
+        """
+        input:
+            D : decoder input of each head. [num_heads x batch_size x T x input_size]
+        output: probability distribution at each step for each head [num_heads x batch_size x num_steps x num_classes]
+        """
+        num_heads, batch_size, T, input_size = D.shape
+        num_steps = batch_max_length + 1
+        heads = torch.arange(num_heads, device=D.device).unsqueeze(1)
+
+        with torch.no_grad():
+            # SelectiveDecoder.first_attention gating, then the step-invariant i2h projection
+            D = D.reshape(num_heads, batch_size * T, input_size)
+            D = D * torch.baddbmm(self.first_attention_bias, D, self.first_attention_weight)
+            D_proj = torch.baddbmm(self.i2h_bias, D, self.i2h_weight).view(num_heads, batch_size, T, self.hidden_size)
+            D = D.view(num_heads, batch_size, T, input_size)
+
+            probs = D.new_zeros(num_heads, batch_size, num_steps, self.num_classes)
+            h = D.new_zeros(num_heads, batch_size, self.hidden_size)
+            c = D.new_zeros(num_heads, batch_size, self.hidden_size)
+            targets = torch.zeros(num_heads, batch_size, dtype=torch.long, device=D.device)  # [GO] token
+            active = torch.arange(batch_size, device=D.device)
+            finished = torch.zeros(num_heads, batch_size, dtype=torch.bool, device=D.device)
+
+            for i in range(num_steps):
+                n = active.numel()
+                prev_hidden_proj = torch.baddbmm(self.h2h_bias, h, self.h2h_weight)
+                e = torch.matmul(torch.tanh(D_proj + prev_hidden_proj.unsqueeze(2)), self.score_weight.unsqueeze(1))
+                alpha = F.softmax(e, dim=2)  # heads x n x T x 1
+                context = torch.bmm(alpha.view(num_heads * n, 1, T),
+                                    D.reshape(num_heads * n, T, input_size)).view(num_heads, n, input_size)
+
+                gates = torch.baddbmm(self.rnn_bias, context, self.rnn_context_weight)
+                gates = torch.baddbmm(gates, h, self.rnn_hidden_weight) + self.rnn_embedding[heads, targets]
+                in_gate, forget_gate, cell_gate, out_gate = gates.chunk(4, 2)
+                c = torch.sigmoid(forget_gate) * c + torch.sigmoid(in_gate) * torch.tanh(cell_gate)
+                h = torch.sigmoid(out_gate) * torch.tanh(c)
+
+                probs_step = torch.baddbmm(self.generator_bias, h, self.generator_weight)
+                targets = probs_step.argmax(2)
+                if not early_exit:
+                    probs[:, :, i, :] = probs_step
+                    continue
+
+                # a sample leaves the loop once every head emitted [s]
+                probs[:, active, i, :] = probs_step
+                finished = finished | (targets == self.eos_index)
+                running = ~finished.all(0)
+                if not running.all():
+                    if not running.any():
+                        break
+                    active, finished, targets = active[running], finished[:, running], targets[:, running]
+                    D, D_proj, h, c = D[:, running], D_proj[:, running], h[:, running], c[:, running]
+
+        return probs
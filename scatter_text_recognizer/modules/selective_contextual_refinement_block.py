@@ -13,10 +13,13 @@ class SelectiveContextualRefinementBlock(nn.Module):
 
         self.sequence_modeling_output = visual_size
         self.selective_decoder = SelectiveDecoder(2*visual_size, hidden_size, num_class)
-    def forward(self, visual_feature, contextual_feature, attn_text, is_train, batch_max_length):
+    def forward(self, visual_feature, contextual_feature, attn_text, is_train, batch_max_length, early_exit=False, decode=True):
         contextual_feature = self.sequence_modeling(contextual_feature)
+        if not decode:
+            # later blocks still need contextual_feature
+            return contextual_feature, None
         D = torch.cat((contextual_feature, visual_feature), 2)
-        block_pred = self.selective_decoder(D, attn_text, is_train, batch_max_length=batch_max_length)
+        block_pred = self.selective_decoder(D, attn_text, is_train, batch_max_length=batch_max_length, early_exit=early_exit)
         
         return contextual_feature, block_pred
 
@@ -2,19 +2,19 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import math
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 class SelectiveDecoder(nn.Module):
     
     def __init__(self, input_size, hidden_size, output_size):
         super(SelectiveDecoder, self).__init__()
         self.first_attention = nn.Linear(input_size, input_size)
         self.second_attention = Attention(input_size, hidden_size, output_size)
-    def forward(self, x, text, is_train, batch_max_length):
+    def forward(self, x, text, is_train, batch_max_length, early_exit=False):
         attention_map = self.first_attention(x)
         x = x*attention_map
-        decode_probs = self.second_attention(x, text, is_train, batch_max_length)
+        decode_probs = self.second_attention(x, text, is_train, batch_max_length, early_exit=early_exit)
         return decode_probs
 class Attention(nn.Module):
+    eos_index = 1  # [s] in AttnLabelConverter
 
     def __init__(self, input_size, hidden_size, num_classes):
         super(Attention, self).__init__()
@@ -23,47 +23,60 @@ class Attention(nn.Module):
         self.num_classes = num_classes
         self.generator = nn.Linear(hidden_size, num_classes)
 
-    def _char_to_onehot(self, input_char, onehot_dim=38):
-        input_char = input_char.unsqueeze(1)
-        batch_size = input_char.size(0)
-        one_hot = torch.FloatTensor(batch_size, onehot_dim).zero_().to(device)
-        one_hot = one_hot.scatter_(1, input_char, 1)
-        return one_hot
-
-    def forward(self, batch_H, text, is_train=True, batch_max_length=25):
+    def forward(self, batch_H, text, is_train=True, batch_max_length=25, early_exit=False):
         """
         input:
             batch_H : contextual_feature H = hidden state of encoder. [batch_size x num_steps x contextual_feature_channels]
             text : the text-index of each image. [batch_size x (max_length+1)]. +1 for [GO] token. text[:, 0] = [GO].
+            early_exit : at inference, drop sequences from the batch once they emit [s] and stop when all did.
+                Steps after [s] are left as zeros.
         output: probability distribution at each step [batch_size x num_steps x num_classes]
         """
         batch_size = batch_H.size(0)
         num_steps = batch_max_length + 1  # +1 for [s] at end of sentence.
 
-        output_hiddens = torch.FloatTensor(batch_size, num_steps, self.hidden_size).fill_(0).to(device)
-        hidden = (torch.FloatTensor(batch_size, self.hidden_size).fill_(0).to(device),
-                  torch.FloatTensor(batch_size, self.hidden_size).fill_(0).to(device))
+        output_hiddens = batch_H.new_zeros(batch_size, num_steps, self.hidden_size)
+        hidden = (batch_H.new_zeros(batch_size, self.hidden_size),
+                  batch_H.new_zeros(batch_size, self.hidden_size))
+
+        # batch_H is the same at every step: project it once, and look one-hot vectors up instead of building them
+        batch_H_proj = self.attention_cell.i2h(batch_H)
+        onehots = torch.eye(self.num_classes, device=batch_H.device)
 
         if is_train:
             for i in range(num_steps):
                 # one-hot vectors for a i-th char. in a batch
-                char_onehots = self._char_to_onehot(text[:, i], onehot_dim=self.num_classes)
+                char_onehots = onehots[text[:, i]]
                 # hidden : decoder's hidden s_{t-1}, batch_H : encoder's hidden H, char_onehots : one-hot(y_{t-1})
-                hidden, alpha = self.attention_cell(hidden, batch_H, char_onehots)
+                hidden, alpha = self.attention_cell(hidden, batch_H, char_onehots, batch_H_proj)
                 output_hiddens[:, i, :] = hidden[0]  # LSTM hidden index (0: hidden, 1: Cell)
             probs = self.generator(output_hiddens)
 
         else:
-            targets = torch.LongTensor(batch_size).fill_(0).to(device)  # [GO] token
-            probs = torch.FloatTensor(batch_size, num_steps, self.num_classes).fill_(0).to(device)
+            targets = torch.zeros(batch_size, dtype=torch.long, device=batch_H.device)  # [GO] token
+            probs = batch_H.new_zeros(batch_size, num_steps, self.num_classes)
 
+            active = torch.arange(batch_size, device=batch_H.device)  # rows of probs still being decoded
             for i in range(num_steps):
-                char_onehots = self._char_to_onehot(targets, onehot_dim=self.num_classes)
-                hidden, alpha = self.attention_cell(hidden, batch_H, char_onehots)
+                char_onehots = onehots[targets]
+                hidden, alpha = self.attention_cell(hidden, batch_H, char_onehots, batch_H_proj)
                 probs_step = self.generator(hidden[0])
-                probs[:, i, :] = probs_step
                 _, next_input = probs_step.max(1)
                 targets = next_input
+                if not early_exit:
+                    probs[:, i, :] = probs_step
+                    continue
+
+                probs[active, i, :] = probs_step
+                running = next_input != self.eos_index
+                if not running.all():
+                    if not running.any():
+                        break
+                    active = active[running]
+                    batch_H = batch_H[running]
+                    batch_H_proj = batch_H_proj[running]
+                    hidden = (hidden[0][running], hidden[1][running])
+                    targets = targets[running]
 
         return probs  # batch_size x num_steps x num_classes
 class AttentionCell(nn.Module):
@@ -76,9 +89,11 @@ class AttentionCell(nn.Module):
         self.rnn = nn.LSTMCell(input_size + num_embeddings, hidden_size)
         self.hidden_size = hidden_size
 
-    def forward(self, prev_hidden, batch_H, char_onehots):
+    def forward(self, prev_hidden, batch_H, char_onehots, batch_H_proj=None):
         # [batch_size x num_encoder_step x num_channel] -> [batch_size x num_encoder_step x hidden_size]
-        batch_H_proj = self.i2h(batch_H)
+        # callers decoding several steps over the same batch_H pass its projection in
+        if batch_H_proj is None:
+            batch_H_proj = self.i2h(batch_H)
         prev_hidden_proj = self.h2h(prev_hidden[0]).unsqueeze(1)
         e = self.score(torch.tanh(batch_H_proj + prev_hidden_proj))  # batch_size x num_encoder_step * 1
 
@@ -13,7 +13,8 @@ class BidirectionalLSTM(nn.Module):
         input : visual feature [batch_size x T x input_size]
         output : contextual feature [batch_size x T x output_size]
         """
-        self.rnn.flatten_parameters()
+        if hasattr(self.rnn, 'flatten_parameters'):  # dynamically quantized LSTMs have no flat weights
+            self.rnn.flatten_parameters()
         recurrent, _ = self.rnn(input)  # batch_size x T x input_size -> batch_size x T x (2*hidden_size)
         output = self.linear(recurrent)  # batch_size x T x output_size
         return output
@@ -0,0 +1,96 @@
+""" Accuracy / latency of a dynamically quantized SCATTER against the float model, on CPU.
+Runs validation() from the package's test.py on the same evaluation data for both models. From the repository root:
+    python -m scatter_text_recognizer.quantize_eval --eval_data <lmdb folder> --saved_model <SCATTER checkpoint>
+"""
+import time
+import string
+import argparse
+
+import torch
+import torch.utils.data
+
+from . import test
+from .test import validation
+from .utils import AttnLabelConverter, quantize_dynamic
+from .dataset import hierarchical_dataset, AlignCollate
+from .model import SCATTER
+
+# dynamic quantization only runs on CPU, and validation() moves batches to test.device
+device = test.device = torch.device('cpu')
+
+
+def evaluate(model, criterion, evaluation_loader, converter, opt):
+    start_time = time.time()
+    with torch.no_grad():
+        _, accuracy, norm_ED, _, _, _, infer_time, length_of_data = validation(
+            model, criterion, evaluation_loader, converter, opt)
+    total_time = time.time() - start_time
+    return accuracy, norm_ED, infer_time / length_of_data * 1000, total_time
+
+
+def quantize_eval(opt):
+    converter = AttnLabelConverter(opt.character)
+    opt.num_class = len(converter.character)
+    if opt.rgb:
+        opt.input_channel = 3
+
+    model = torch.nn.DataParallel(SCATTER(opt)).to(device)
+    print('loading pretrained model from %s' % opt.saved_model)
+    model.load_state_dict(torch.load(opt.saved_model, map_location=device))
+    model.eval()
+    quantized_model = quantize_dynamic(model)
+
+    criterion = torch.nn.CrossEntropyLoss(ignore_index=0).to(device)  # ignore [GO] token = ignore index 0
+    AlignCollate_evaluation = AlignCollate(imgH=opt.imgH, imgW=opt.imgW, keep_ratio_with_pad=opt.PAD)
+    eval_data, eval_data_log = hierarchical_dataset(root=opt.eval_data, opt=opt)
+    evaluation_loader = torch.utils.data.DataLoader(
+        eval_data, batch_size=opt.batch_size,
+        shuffle=False,
+        num_workers=int(opt.workers),
+        collate_fn=AlignCollate_evaluation, pin_memory=False)
+
+    torch.set_num_threads(opt.num_threads)
+    dashed_line = '-' * 80
+    print(dashed_line)
+    results = {}
+    for name, m in (('float', model), ('int8', quantized_model)):
+        results[name] = evaluate(m, criterion, evaluation_loader, converter, opt)
+        accuracy, norm_ED, forward_ms, total_time = results[name]
+        print(f'{name:5s}\tAcc {accuracy:0.3f}\tnormalized_ED {norm_ED:0.3f}\t'
+              f'forward {forward_ms:0.3f} ms/image\ttotal {total_time:0.1f} s')
+    print(dashed_line)
+    print(f'accuracy change: {results["int8"][0] - results["float"][0]:+0.3f} points\t'
+          f'speedup: {results["float"][2] / results["int8"][2]:0.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--eval_data', required=True, help='path to evaluation dataset')
+    parser.add_argument('--workers', type=int, help='number of data loading workers', default=4)
+    parser.add_argument('--num_threads', type=int, default=torch.get_num_threads(), help='torch CPU threads')
+    parser.add_argument('--batch_size', type=int, default=192, help='input batch size')
+    parser.add_argument('--saved_model', required=True, help="path to saved_model to evaluation")
+    """ Data processing """
+    parser.add_argument('--batch_max_length', type=int, default=35, help='maximum-label-length')
+    parser.add_argument('--imgH', type=int, default=32, help='the height of the input image')
+    parser.add_argument('--imgW', type=int, default=100, help='the width of the input image')
+    parser.add_argument('--rgb', action='store_true', help='use rgb input')
+    parser.add_argument('--character', type=str, default='0123456789abcdefghijklmnopqrstuvwxyz', help='character label')
+    parser.add_argument('--sensitive', action='store_true', default=True, help='for sensitive character mode')
+    parser.add_argument('--PAD', action='store_true', help='whether to keep ratio then pad for image resize')
+    parser.add_argument('--data_filtering_off', action='store_true', help='for data_filtering_off mode')
+    """ Model Architecture """
+    parser.add_argument('--num_fiducial', type=int, default=20, help='number of fiducial points of TPS-STN')
+    parser.add_argument('--input_channel', type=int, default=1, help='the number of input channel of Feature extractor')
+    parser.add_argument('--output_channel', type=int, default=512,
+                        help='the number of output channel of Feature extractor')
+    parser.add_argument('--hidden_size', type=int, default=512, help='the size of the LSTM hidden state')
+
+    opt = parser.parse_args()
+
+    """ vocab / character number configuration """
+    if opt.sensitive:
+        opt.character = string.printable[:-6]  # same with ASTER setting (use 94 char).
+
+    opt.num_gpu = 0
+    quantize_eval(opt)
@@ -1,4 +1,6 @@
 import torch
+import torch.nn as nn
+import torch.nn.functional as F
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 
@@ -129,6 +131,49 @@ class TransLabelConverter(object):
         return texts
 
 
+def attn_greedy_decode(preds, eos_index=1):
+    """ Greedy decoding of attention decoder output.
+    input:
+        preds: logits of each step. [batch_size x num_steps x num_classes]
+    output:
+        index: argmax of each step. [batch_size x num_steps]
+        length: number of steps before the first [s] (num_steps when there is none). [batch_size]
+        confidence: product of the max probabilities of those steps, 0 for empty predictions. [batch_size]
+    """
+    num_steps = preds.size(1)
+    max_log_prob, index = F.log_softmax(preds, dim=2).max(dim=2)
+    is_eos = index == eos_index
+    length = torch.where(is_eos.any(1), is_eos.int().argmax(1), torch.full_like(index[:, 0], num_steps))
+    in_text = torch.arange(num_steps, device=preds.device).unsqueeze(0) < length.unsqueeze(1)
+    confidence = (max_log_prob * in_text).sum(1).exp()
+    confidence = torch.where(length > 0, confidence, torch.zeros_like(confidence))
+    return index, length, confidence
+
+
+def ctc_greedy_decode(preds, blank_index=0):
+    """ Best-path CTC decoding.
+    input:
+        preds: logits of each frame. [batch_size x T x num_classes]
+    output:
+        index: argmax of each frame. [batch_size x T]
+        keep: frames that emit a character, i.e. not blank and not a repeat of the previous frame. [batch_size x T]
+        confidence: product of the max probabilities of the kept frames, 0 for empty predictions. [batch_size]
+    """
+    max_prob, index = F.softmax(preds, dim=2).max(dim=2)
+    keep = index != blank_index
+    keep[:, 1:] &= index[:, 1:] != index[:, :-1]
+    confidence = torch.where(keep, max_prob, torch.ones_like(max_prob)).prod(1)
+    confidence = torch.where(keep.any(1), confidence, torch.zeros_like(confidence))
+    return index, keep, confidence
+
+
+def quantize_dynamic(model):
+    """ Dynamic int8 quantization of the LSTM, LSTMCell and Linear layers (CPU inference only).
+    Weights are stored as int8 and activations are quantized on the fly, so no calibration data is needed.
+    """
+    return torch.quantization.quantize_dynamic(model, {nn.LSTM, nn.LSTMCell, nn.Linear}, dtype=torch.qint8)
+
+
 class Averager(object):
     """Compute average for torch.Tensor, used for loss average."""
 
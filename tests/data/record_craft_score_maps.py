@@ -0,0 +1,102 @@
+""" Write craft_score_maps.npz: CRAFT-like score/link maps and the boxes and polys the reference craft_utils finds on them.
+The reference is the implementation before the ROI-local and vectorized post-processing, extract it with
+    git show c8612c2:craft_text_detector/craft_utils.py > /tmp/craft_utils_ref.py
+    python tests/data/record_craft_score_maps.py --reference /tmp/craft_utils_ref.py
+Each case stores <case>_textmap, <case>_linkmap, <case>_boxes [N, 4, 2] and the polys (craft_poly=True) as
+<case>_poly_points with <case>_poly_sizes, a size of 0 meaning the box is used instead of a polygon.
+"""
+import os
+import argparse
+import importlib.util
+import numpy as np
+
+TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT = 0.7, 0.4, 0.4
+
+def gaussian(canvas, cx, cy, sx, sy, angle, peak):
+    h, w = canvas.shape
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    c, s = np.cos(angle), np.sin(angle)
+    u, v = (x - cx) * c + (y - cy) * s, -(x - cx) * s + (y - cy) * c
+    np.maximum(canvas, peak * np.exp(-0.5 * ((u / sx) ** 2 + (v / sy) ** 2)), out=canvas)
+
+def draw_word(textmap, linkmap, centers, char_h, angle, rng):
+    """ one character heatmap per center and one affinity blob between neighbouring characters """
+    for cx, cy in centers:
+        gaussian(textmap, cx, cy, char_h * 0.3, char_h * 0.45, angle, rng.uniform(0.75, 1.0))
+    for (x0, y0), (x1, y1) in zip(centers[:-1], centers[1:]):
+        gaussian(linkmap, (x0 + x1) / 2, (y0 + y1) / 2, char_h * 0.2, char_h * 0.3, angle, rng.uniform(0.5, 0.9))
+
+def straight_word(x, y, num_chars, char_h, angle):
+    step = char_h * 0.8
+    return [(x + i * step * np.cos(angle), y + i * step * np.sin(angle)) for i in range(num_chars)]
+
+def curved_word(cx, cy, radius, start, num_chars, char_h):
+    step = char_h * 0.8 / radius
+    return [(cx + radius * np.cos(start + i * step), cy + radius * np.sin(start + i * step)) for i in range(num_chars)]
+
+def form_case(rng):
+    """ dense page: rows of short horizontal words of a few sizes """
+    textmap, linkmap = np.zeros((240, 320), np.float32), np.zeros((240, 320), np.float32)
+    y = 10
+    while y < 225:
+        char_h = rng.choice([6, 8, 12])
+        x = rng.uniform(4, 20)
+        while x < 280:
+            num_chars = rng.integers(1, 8)
+            draw_word(textmap, linkmap, straight_word(x, y, num_chars, char_h, 0), char_h, 0, rng)
+            x += num_chars * char_h * 0.8 + rng.uniform(char_h, 3 * char_h)
+        y += char_h * rng.uniform(1.6, 2.2)
+    return textmap, linkmap
+
+def curved_case(rng):
+    """ signage: large rotated and curved words, long enough for polygons """
+    textmap, linkmap = np.zeros((320, 320), np.float32), np.zeros((320, 320), np.float32)
+    for cx, cy, radius, start, num_chars, char_h in [(160, 180, 110, np.pi * 1.15, 10, 18), (160, 60, 140, np.pi * 0.3, 8, 16),
+            (70, 260, 60, np.pi * 1.2, 7, 14), (250, 250, 50, np.pi * 0.9, 6, 12), (240, 90, 70, np.pi * 1.6, 6, 14),
+            (90, 90, 45, np.pi * 0.1, 5, 10)]:
+        draw_word(textmap, linkmap, curved_word(cx, cy, radius, start, num_chars, char_h), char_h, 0, rng)
+    for x, y, num_chars, char_h, angle in [(30, 150, 8, 16, 0.3), (60, 300, 10, 14, -0.05), (200, 160, 4, 22, -0.6)]:
+        draw_word(textmap, linkmap, straight_word(x, y, num_chars, char_h, angle), char_h, angle, rng)
+    return textmap, linkmap
+
+def noisy_case(rng):
+    """ photo: a few words over thousands of tiny weak components and some strong specks """
+    textmap, linkmap = np.zeros((200, 240), np.float32), np.zeros((200, 240), np.float32)
+    for x, y, num_chars, char_h, angle in [(20, 40, 6, 14, 0.1), (40, 120, 9, 12, 0), (140, 170, 4, 10, -0.2)]:
+        draw_word(textmap, linkmap, straight_word(x, y, num_chars, char_h, angle), char_h, angle, rng)
+    specks = rng.random(textmap.shape) < 0.08
+    np.maximum(textmap, np.where(specks, rng.uniform(0.3, 0.8, textmap.shape), 0).astype(np.float32), out=textmap)
+    links = rng.random(linkmap.shape) < 0.03
+    np.maximum(linkmap, np.where(links, rng.uniform(0.3, 0.6, linkmap.shape), 0).astype(np.float32), out=linkmap)
+    return textmap, linkmap
+
+cases = {'form': form_case, 'curved': curved_case, 'noisy': noisy_case}
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location('craft_utils_reference', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record CRAFT score maps and the reference post-processing output')
+    parser.add_argument('--reference', required=True, type=str, help='craft_utils.py of the reference implementation')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'craft_score_maps.npz'), type=str)
+    args = parser.parse_args()
+    reference = load_reference(args.reference)
+
+    arrays = {}
+    for seed, (name, make) in enumerate(cases.items()):
+        textmap, linkmap = make(np.random.default_rng(seed))
+        # stored as float16, the reference runs on exactly the maps the test loads
+        textmap, linkmap = textmap.astype(np.float16).astype(np.float32), linkmap.astype(np.float16).astype(np.float32)
+        boxes, polys = reference.getDetBoxes(textmap, linkmap, TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT, poly=True)
+        polys = [np.zeros((0, 2), np.float32) if p is None else np.asarray(p, dtype=np.float32) for p in polys]
+        arrays[name + '_textmap'] = textmap.astype(np.float16)
+        arrays[name + '_linkmap'] = linkmap.astype(np.float16)
+        arrays[name + '_boxes'] = np.asarray(boxes, dtype=np.float32).reshape(-1, 4, 2)
+        arrays[name + '_poly_points'] = np.concatenate(polys) if polys else np.zeros((0, 2), np.float32)
+        arrays[name + '_poly_sizes'] = np.array([len(p) for p in polys], dtype=np.int64)
+        print('%-8s %d boxes, %d polys' % (name, len(boxes), sum(len(p) > 0 for p in polys)))
+    np.savez_compressed(args.output, **arrays)
+    print('wrote ' + args.output)
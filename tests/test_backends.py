@@ -0,0 +1,86 @@
+""" Exported CRAFT backends against the eager model on the same, unpadded canvases: score maps and the boxes
+craft_utils finds on them, for canvases that fill a bucket and smaller ones served by a larger bucket """
+import numpy as np
+import cv2
+import pytest
+import torch
+from craft_text_detector import (CRAFT, CraftScoreMaps, EagerBackend, EXPORTERS, craft_utils, export_name, imgproc,
+                                 load_backend, max_score_difference)
+from craft_text_detector.refinenet import RefineNet
+
+BUCKETS = [(160, 224), (224, 256)]
+TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT = 0.7, 0.4, 0.4
+
+def page(height, width, seed):
+    """ dark words on a light page """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 235, np.uint8)
+    for _ in range(height * width // 1500):
+        x, y = int(rng.integers(0, width - 20)), int(rng.integers(10, height))
+        cv2.putText(image, 'word', (x, y), cv2.FONT_HERSHEY_SIMPLEX, rng.uniform(0.3, 0.7), (20, 20, 20), 1)
+    return image
+
+def canvas(image):
+    x, _, _ = imgproc.CanvasPreprocessor(256)(image)
+    return torch.from_numpy(x.copy())
+
+def rescale(convs, channel, outputs):
+    """ scale the final convs of a score map (summed when several) so that its median maps to 0.3 and its 98th percentile to 0.9 """
+    q50, q98 = torch.quantile(outputs, 0.5), torch.quantile(outputs, 0.98)
+    scale = 0.6 / (q98 - q50)
+    for conv in convs:
+        conv.weight[channel] *= scale
+        conv.bias[channel] *= scale
+    convs[0].bias[channel] += 0.3 - q50 * scale
+
+@pytest.fixture(scope='module', params=[False, True], ids=['craft', 'craft_refiner'])
+def model(request):
+    """ CRAFT (and the link refiner) with random weights, the final convs rescaled so that the score maps cross the thresholds on text """
+    torch.manual_seed(0)
+    craft = CRAFT().eval()
+    refine_net = RefineNet().eval() if request.param else None
+    x = canvas(page(200, 256, 0))
+    with torch.no_grad():
+        y, feature = craft(x)
+        classifier = craft.conv_cls[-1]
+        for c in range(2):
+            rescale([classifier], c, y[..., c])
+        if refine_net is not None:
+            y, feature = craft(x)
+            rescale([aspp[-1] for aspp in (refine_net.aspp1, refine_net.aspp2, refine_net.aspp3, refine_net.aspp4)], 0,
+                    refine_net(y, feature))
+    return CraftScoreMaps(craft, refine_net).eval()
+
+@pytest.fixture(scope='module', params=sorted(EXPORTERS))
+def backend(request, model, tmp_path_factory):
+    if request.param == 'onnxruntime':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+    export_dir = tmp_path_factory.mktemp(request.param)
+    for bucket in BUCKETS:
+        EXPORTERS[request.param](model, bucket, str(export_dir / export_name(bucket, model.refine_net is not None, request.param)))
+    return load_backend(request.param, model, str(export_dir), fallback_to_eager=False)
+
+def boxes(score_maps):
+    score_text, score_link = (s[0].numpy() for s in score_maps)
+    return np.asarray(craft_utils.getDetBoxes(score_text, score_link, TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT)[0]).reshape(-1, 4, 2)
+
+# image sizes giving canvases of exactly 160x224 and 224x256, and a 128x160 one run on the 160x224 graph
+@pytest.mark.parametrize('height, width', [(140, 220), (200, 256), (100, 150)])
+def test_boxes_match_eager_on_unpadded_canvas(model, backend, height, width):
+    x = canvas(page(height, width, 1))
+    eager = EagerBackend(model)
+    expected = boxes(eager(x))
+    assert len(expected) > 10
+    assert max_score_difference(eager, backend, [x]) < 1e-3
+    np.testing.assert_allclose(boxes(backend(x)), expected, atol=1e-3)
+
+def test_larger_canvas_needs_fallback(model, backend):
+    x = torch.zeros(1, 3, 256, 288)
+    with pytest.raises(ValueError):
+        backend(x)
+    backend.fallback = EagerBackend(model)
+    try:
+        assert max_score_difference(EagerBackend(model), backend, [x]) == 0
+    finally:
+        backend.fallback = None
@@ -0,0 +1,99 @@
+""" craft_utils post-processing against the reference implementation (c8612c2), on the maps and results recorded
+in data/craft_score_maps.npz by data/record_craft_score_maps.py """
+import os
+import numpy as np
+import cv2
+import pytest
+from craft_text_detector import craft_utils
+
+TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT = 0.7, 0.4, 0.4
+CASES = ('form', 'curved', 'noisy')
+
+@pytest.fixture(scope='module')
+def recorded():
+    with np.load(os.path.join(os.path.dirname(__file__), 'data', 'craft_score_maps.npz'), allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def score_maps(recorded, case):
+    return recorded[case + '_textmap'].astype(np.float32), recorded[case + '_linkmap'].astype(np.float32)
+
+def assert_same_boxes(boxes, expected):
+    assert len(boxes) == len(expected)
+    np.testing.assert_allclose(np.asarray(boxes, dtype=np.float32).reshape(-1, 4, 2), expected, atol=1e-4)
+
+def assert_same_polys(polys, expected):
+    assert [p is None for p in polys] == [p is None for p in expected]
+    for poly, expected_poly in zip(polys, expected):
+        if poly is not None:
+            np.testing.assert_allclose(poly, expected_poly, atol=1e-3)
+
+@pytest.mark.parametrize('case', CASES)
+def test_boxes_match_reference(recorded, case):
+    textmap, linkmap = score_maps(recorded, case)
+    boxes, polys = craft_utils.getDetBoxes(textmap, linkmap, TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT, poly=False)
+    assert_same_boxes(boxes, recorded[case + '_boxes'])
+    assert polys == [None] * len(boxes)
+
+@pytest.mark.parametrize('case', CASES)
+def test_maps_are_not_modified(recorded, case):
+    textmap, linkmap = score_maps(recorded, case)
+    craft_utils.getDetBoxes(textmap, linkmap, TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT, poly=True)
+    np.testing.assert_array_equal(textmap, recorded[case + '_textmap'].astype(np.float32))
+    np.testing.assert_array_equal(linkmap, recorded[case + '_linkmap'].astype(np.float32))
+
+@pytest.mark.parametrize('case', CASES)
+def test_component_scores_match_per_label_loop(recorded, case):
+    textmap, linkmap = score_maps(recorded, case)
+    text_score = (textmap > LOW_TEXT) | (linkmap > LINK_THRESHOLD)
+    nLabels, labels = cv2.connectedComponents(text_score.astype(np.uint8), connectivity=4)
+    max_text, area, mean_link = craft_utils.getComponentScores(textmap, labels, nLabels, linkmap)
+    for k in range(nLabels):
+        mask = labels == k
+        assert max_text[k] == np.max(textmap[mask])
+        assert area[k] == np.count_nonzero(mask)
+        assert mean_link[k] == pytest.approx(np.mean(linkmap[mask]), rel=1e-5)
+
+def recorded_polys(recorded, case):
+    sizes = recorded[case + '_poly_sizes']
+    points = np.split(recorded[case + '_poly_points'], np.cumsum(sizes)[:-1]) if len(sizes) else []
+    return [p if len(p) else None for p in points]
+
+@pytest.mark.parametrize('case', CASES)
+def test_polys_match_reference(recorded, case):
+    textmap, linkmap = score_maps(recorded, case)
+    boxes, polys = craft_utils.getDetBoxes(textmap, linkmap, TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT, poly=True)
+    assert_same_boxes(boxes, recorded[case + '_boxes'])
+    assert_same_polys(polys, recorded_polys(recorded, case))
+
+def test_line_hits_mask_matches_full_frame_line():
+    rng = np.random.default_rng(0)
+    mask = rng.random((40, 60)) < 0.02
+    for _ in range(2000):
+        p = rng.uniform(-20, 80, 4)
+        line_img = np.zeros(mask.shape, dtype=np.uint8)
+        cv2.line(line_img, (int(p[0]), int(p[1])), (int(p[2]), int(p[3])), 1, thickness=1)
+        assert craft_utils.lineHitsMask(mask, p) == bool(np.any(mask[line_img != 0]))
+
+def pack(textmap, linkmap):
+    """ the packed map OCR.pack_score_maps copies to the host, built on numpy """
+    scoremask = (textmap > LOW_TEXT).astype(np.uint8) * craft_utils.TEXT_BIT
+    scoremask |= (linkmap > LINK_THRESHOLD).astype(np.uint8) * craft_utils.LINK_BIT
+    scoremask |= (textmap >= TEXT_THRESHOLD).astype(np.uint8) * craft_utils.STRONG_BIT
+    return scoremask
+
+@pytest.mark.parametrize('case', CASES)
+def test_packed_matches_reference(recorded, case):
+    boxes, polys = craft_utils.getDetBoxes_packed(pack(*score_maps(recorded, case)), poly=True)
+    assert_same_boxes(boxes, recorded[case + '_boxes'])
+    assert_same_polys(polys, recorded_polys(recorded, case))
+
+@pytest.mark.parametrize('case', CASES)
+def test_ocr_pack_score_maps(recorded, case):
+    torch = pytest.importorskip('torch')
+    ocr = pytest.importorskip('ocr', exc_type=ImportError)
+    from ocr_config import Config
+    cfg = Config()
+    cfg.craft_text_threshold, cfg.craft_link_threshold, cfg.craft_low_text = TEXT_THRESHOLD, LINK_THRESHOLD, LOW_TEXT
+    textmap, linkmap = score_maps(recorded, case)
+    scoremask = ocr.OCR(cfg).pack_score_maps(torch.from_numpy(textmap), torch.from_numpy(linkmap))
+    np.testing.assert_array_equal(scoremask, pack(textmap, linkmap))
@@ -0,0 +1,108 @@
+""" DetectionCache: byte accounting of the in-memory LRU, the .npz disk tier and its eviction by mtime, and the key """
+import os
+import numpy as np
+import pytest
+from detection_cache import DetectionCache
+from ocr_config import Config
+
+def result(num_boxes, seed, with_score=True):
+    """ boxes [N, 4, 2], polys of varying lengths, a score map and a target ratio """
+    rng = np.random.default_rng(seed)
+    boxes = list(rng.uniform(0, 500, (num_boxes, 4, 2)).astype(np.float32))
+    polys = [rng.uniform(0, 500, (4 + 2 * (i % 4), 2)).astype(np.float32) for i in range(num_boxes)]
+    score_text = rng.random((40, 60), dtype=np.float32) if with_score else None
+    return boxes, polys, score_text, float(rng.uniform(0.5, 2))
+
+def size(entry):
+    boxes, polys, score_text, _ = entry
+    return sum(b.nbytes for b in boxes) + sum(p.nbytes for p in polys) + (score_text.nbytes if score_text is not None else 0)
+
+def assert_same_result(cached, expected):
+    boxes, polys, score_text, target_ratio = cached
+    assert len(boxes) == len(expected[0]) and len(polys) == len(expected[1])
+    for a, b in zip(list(boxes) + list(polys), expected[0] + expected[1]):
+        np.testing.assert_array_equal(a, b)
+    if expected[2] is None:
+        assert score_text is None
+    else:
+        np.testing.assert_array_equal(score_text, expected[2])
+    assert target_ratio == expected[3]
+
+def test_lru_byte_accounting():
+    entries = {key: result(5, seed) for seed, key in enumerate('abcd')}
+    cache = DetectionCache(3 * size(entries['a']))
+    for key in 'abc':
+        cache.put(key, *entries[key])
+    assert cache.nbytes == sum(size(entries[key]) for key in 'abc')
+    cache.put('a', *entries['a'])    # replacing an entry does not count it twice
+    assert cache.nbytes == sum(size(entries[key]) for key in 'abc')
+
+    assert cache.get('b') is not None    # 'c' is now the least recently used
+    cache.put('d', *entries['d'])
+    assert list(cache.entries) == ['a', 'b', 'd']
+    assert cache.get('c') is None
+    assert cache.nbytes == sum(size(entries[key]) for key in 'abd')
+
+    large = result(2000, 4)
+    assert size(large) > cache.max_bytes
+    cache.put('large', *large)    # larger than the whole cache: not kept, nothing evicted
+    assert cache.get('large') is None
+    assert list(cache.entries) == ['a', 'b', 'd']
+
+def test_hits_are_copies():
+    cache = DetectionCache(2**20)
+    expected = result(3, 0)
+    cache.put('a', *expected)
+    boxes, polys, score_text, _ = cache.get('a')
+    boxes[0] += 1
+    polys.pop()
+    with pytest.raises(ValueError):
+        score_text[0, 0] = 0
+    assert_same_result(cache.get('a'), expected)
+
+@pytest.mark.parametrize('num_boxes, with_score', [(7, True), (7, False), (0, True)], ids=['ragged_polys', 'no_score', 'empty'])
+def test_disk_round_trip(tmp_path, num_boxes, with_score):
+    expected = result(num_boxes, 0, with_score)
+    DetectionCache(2**20, str(tmp_path)).put('a', *expected)
+    cache = DetectionCache(2**20, str(tmp_path))    # a new process: only the disk tier has the entry
+    assert cache.disk_bytes == os.path.getsize(str(tmp_path / 'a.npz'))
+    cached = cache.get('a')
+    assert_same_result(cached, expected)
+    if with_score:
+        assert not cached[2].flags.writeable
+    assert 'a' in cache.entries    # a disk hit is promoted to memory
+    assert cache.get('missing') is None
+
+def test_disk_eviction_by_mtime(tmp_path):
+    entries = {key: result(5, seed) for seed, key in enumerate('abc')}
+    cache = DetectionCache(0, str(tmp_path))    # nothing stays in memory, every get reads the disk tier
+    for i, key in enumerate('ab'):
+        cache.put(key, *entries[key])
+        os.utime(str(tmp_path / (key + '.npz')), (1000 + i, 1000 + i))
+    file_size = os.path.getsize(str(tmp_path / 'a.npz'))
+    cache.max_disk_bytes = 2 * file_size + file_size // 2
+
+    assert cache.get('a') is not None    # a hit refreshes the mtime: 'b' is now the least recently used
+    cache.put('c', *entries['c'])
+    assert sorted(os.listdir(str(tmp_path))) == ['a.npz', 'c.npz']
+    assert cache.disk_bytes == sum(os.path.getsize(str(tmp_path / name)) for name in os.listdir(str(tmp_path)))
+    assert cache.get('b') is None
+    assert_same_result(cache.get('a'), entries['a'])
+
+def test_key():
+    cfg = Config()
+    image = np.random.default_rng(0).integers(0, 256, (30, 40, 3), dtype=np.uint8)
+    cache = DetectionCache(0)
+    key = cache.key(image, cfg)
+    assert cache.key(image.copy(), cfg) == key
+    assert cache.key(np.asfortranarray(image), cfg) == key
+
+    changed = image.copy()
+    changed[0, 0, 0] ^= 1
+    assert cache.key(changed, cfg) != key
+    assert cache.key(image.reshape(40, 30, 3), cfg) != key
+    cfg.craft_text_threshold += 0.1
+    assert cache.key(image, cfg) != key
+    cfg.craft_text_threshold -= 0.1
+    cache.model_id = 'other weights'
+    assert cache.key(image, cfg) != key
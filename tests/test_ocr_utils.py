@@ -0,0 +1,41 @@
+""" warp_crops against four_point_transform followed by an area resize, on text boxes 2x to 12x the recognizer input """
+import numpy as np
+import cv2
+import torch
+from ocr_utils import four_point_transform, quad_crops, crop_scales, pyramid_level, image_pyramid, warp_crops
+
+def page_with_words():
+    page = np.full((900, 1400), 245, np.uint8)
+    polys = []
+    y = 20
+    for scale in [2, 4.6, 9]:
+        thickness = max(1, int(scale * 2))
+        (w, h), base = cv2.getTextSize('0N8N0N', cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+        cv2.putText(page, '0N8N0N', (20, y + h), cv2.FONT_HERSHEY_SIMPLEX, scale, 15, thickness)
+        pad = h // 4
+        polys.append(np.array([[20 - pad, y - pad], [20 + w + pad, y - pad], [20 + w + pad, y + h + base + pad],
+            [20 - pad, y + h + base + pad]], np.float32))
+        y += h + base + 3 * pad + 20
+    return page, polys
+
+def reference_crops(page, polys, imgH=32, imgW=100):
+    crops = [cv2.resize(four_point_transform(page, p), (imgW, imgH), interpolation=cv2.INTER_AREA) for p in polys]
+    return torch.from_numpy(np.stack(crops)[:, None].astype(np.float32)) * (2 / 255.) - 1
+
+def test_large_boxes_do_not_alias():
+    page, polys = page_with_words()
+    rects, sizes = quad_crops(polys)
+    assert sizes[-1, 0] > 1000    # a word box of more than 10x the recognizer width
+    _, scale_x, scale_y = crop_scales(sizes)
+    levels = image_pyramid(torch.from_numpy(page[None]).float(), pyramid_level(scale_x, scale_y).max() + 1)
+    difference = (warp_crops(levels, rects, sizes) - reference_crops(page, polys)).abs().mean(dim=(1, 2, 3))
+    assert difference.max() < 0.04
+    # a single bilinear tap per output pixel, as without prefiltering, skips most of a large box's pixels
+    single_tap = (warp_crops(levels[:1], rects, sizes, max_taps=1) - reference_crops(page, polys)).abs().mean(dim=(1, 2, 3))
+    assert single_tap[-1] > 2 * difference[-1]
+
+def test_boxes_smaller_than_the_input_ignore_the_pyramid():
+    page, _ = page_with_words()
+    rects, sizes = quad_crops([np.array([[20, 20], [110, 20], [110, 48], [20, 48]], np.float32)])
+    image = torch.from_numpy(page[None]).float()
+    np.testing.assert_allclose(warp_crops(image, rects, sizes), warp_crops(image_pyramid(image), rects, sizes), atol=1e-5)
@@ -0,0 +1,84 @@
+""" Inference paths of the SCATTER attention decoders against the per-step greedy loop with the i2h projection inside
+the cell: early exit, the hoisted projection and the fused heads must give the same attn_greedy_decode output """
+import pytest
+import torch
+pytest.importorskip('scatter_text_recognizer', exc_type=ImportError)
+from scatter_text_recognizer import attn_greedy_decode
+from scatter_text_recognizer.modules.selective_decoder import SelectiveDecoder
+from scatter_text_recognizer.modules.fused_decoder import FusedSelectiveDecoders
+
+NUM_HEADS, BATCH_SIZE, T, INPUT_SIZE, HIDDEN_SIZE, NUM_CLASSES, MAX_LENGTH = 5, 12, 16, 32, 24, 12, 25
+EOS = 1
+
+def counting_decoder():
+    """ a SelectiveDecoder with random weights whose hidden unit 0 counts the steps at the rate given by input channel 0,
+    and whose [s] logit rises with that count: each sample emits [s] at its own step """
+    decoder = SelectiveDecoder(INPUT_SIZE, HIDDEN_SIZE, NUM_CLASSES).eval()
+    with torch.no_grad():
+        decoder.first_attention.weight[0] = 0
+        decoder.first_attention.bias[0] = 1  # channel 0 passes the gating unchanged
+        rnn = decoder.second_attention.attention_cell.rnn
+        unit = torch.arange(4) * HIDDEN_SIZE  # input, forget, cell and output gate rows of unit 0
+        rnn.weight_ih[unit] = 0
+        rnn.weight_hh[unit] = 0
+        rnn.weight_ih[unit[2], 0] = 1  # channel 0 is constant over T, so is the context
+        rnn.bias_ih[unit] = torch.tensor([10., 10., 0., 10.])
+        rnn.bias_hh[unit] = 0
+        generator = decoder.second_attention.generator
+        generator.weight[EOS] = 0
+        generator.weight[EOS, 0] = 20
+        generator.bias[EOS] = -10
+    return decoder
+
+def reference_decode(decoder, x):
+    """ greedy decoding as before the hoisted projection: one-hot built at each step, i2h applied inside the cell """
+    attention = decoder.second_attention
+    x = x * decoder.first_attention(x)
+    hidden = (x.new_zeros(x.size(0), HIDDEN_SIZE), x.new_zeros(x.size(0), HIDDEN_SIZE))
+    targets = torch.zeros(x.size(0), dtype=torch.long)
+    probs = []
+    for _ in range(MAX_LENGTH + 1):
+        char_onehots = x.new_zeros(x.size(0), NUM_CLASSES).scatter_(1, targets.unsqueeze(1), 1)
+        hidden, _ = attention.attention_cell(hidden, x, char_onehots)
+        probs.append(attention.generator(hidden[0]))
+        targets = probs[-1].argmax(1)
+    return torch.stack(probs, 1)
+
+@pytest.fixture(scope='module')
+def heads():
+    torch.manual_seed(0)
+    decoders = [counting_decoder() for _ in range(NUM_HEADS)]
+    D = torch.randn(NUM_HEADS, BATCH_SIZE, T, INPUT_SIZE)
+    D[..., 0] = torch.rand(NUM_HEADS, BATCH_SIZE, 1) * 0.25 + 0.02
+    D[0, 0, :, 0] = 0  # head 0 never emits [s] on sample 0
+    with torch.no_grad():
+        expected = [attn_greedy_decode(reference_decode(decoder, x)) for decoder, x in zip(decoders, D)]
+    return decoders, D, expected
+
+def assert_same_decode(preds, expected):
+    index, length, confidence = attn_greedy_decode(preds)
+    expected_index, expected_length, expected_confidence = expected
+    assert torch.equal(length, expected_length)
+    in_text = torch.arange(MAX_LENGTH + 1).unsqueeze(0) < length.unsqueeze(1)
+    assert torch.equal(index[in_text], expected_index[in_text])
+    torch.testing.assert_close(confidence, expected_confidence, rtol=1e-4, atol=1e-6)
+
+def test_samples_stop_at_varied_steps(heads):
+    _, _, expected = heads
+    lengths = torch.cat([length for _, length, _ in expected])
+    assert len(set(lengths.tolist())) > 10
+    assert (lengths == MAX_LENGTH + 1).sum() == 1
+
+@pytest.mark.parametrize('early_exit', [False, True], ids=['all_steps', 'early_exit'])
+def test_sequential_decoders(heads, early_exit):
+    decoders, D, expected = heads
+    for decoder, x, decoded in zip(decoders, D, expected):
+        with torch.no_grad():
+            assert_same_decode(decoder(x, None, False, MAX_LENGTH, early_exit=early_exit), decoded)
+
+@pytest.mark.parametrize('early_exit', [False, True], ids=['all_steps', 'early_exit'])
+def test_fused_decoders(heads, early_exit):
+    decoders, D, expected = heads
+    preds = FusedSelectiveDecoders(decoders)(D, MAX_LENGTH, early_exit)
+    for head_preds, decoded in zip(preds, expected):
+        assert_same_decode(head_preds, decoded)
@@ -0,0 +1,116 @@
+""" Single-file weight bundle for fast OCR.load_net.
+Compiling runs the ordinary load_net once (torch.load of the checkpoints, key renaming, BatchNorm folding) and writes
+the resulting CRAFT, refiner and SCATTER weights plus the config they were built with into one file:
+8 magic bytes, the header length (uint64 little endian), a JSON header, then the raw tensor data, each tensor
+aligned to 64 bytes. Loading memory-maps the file copy-on-write and points the model parameters at it: nothing is
+unpickled and nothing is read until a page is touched.
+	python weight_bundle.py --output ./weights/ocr.bundle
+then set Config.bundle_path to the output file.
+"""
+import json
+import struct
+import argparse
+from collections import OrderedDict
+import numpy as np
+import torch
+from ocr_utils import fold_batchnorms
+
+MAGIC = b'OCRBNDL1'
+ALIGNMENT = 64
+
+# Config fields that define the architectures; the bundle's values override the Config at load time
+config_fields = ('craft_refine', 'scatter_feature_extraction', 'scatter_pad', 'scatter_batch_max_length', 'scatter_character',
+	'scatter_hidden_size', 'scatter_img_h', 'scatter_img_w', 'scatter_input_channel', 'scatter_num_fiducial',
+	'scatter_output_channel', 'scatter_rgb', 'scatter_sensitive')
+
+def write_bundle(path, models, config, folded):
+	""" models: {name: nn.Module}, config: JSON-serializable dict, folded: {name: whether its BatchNorms were folded} """
+	tensors = OrderedDict()
+	for name, model in models.items():
+		for key, tensor in model.state_dict().items():
+			tensors[name + '.' + key] = tensor.detach().cpu().contiguous().numpy()
+
+	table = OrderedDict()
+	offset = 0
+	for key, array in tensors.items():
+		table[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset, 'nbytes': array.nbytes}
+		offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+	header = json.dumps({'config': config, 'folded': folded, 'models': list(models), 'tensors': table}).encode()
+	data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+	with open(path, 'wb') as f:
+		f.write(MAGIC)
+		f.write(struct.pack('<Q', len(header)))
+		f.write(header)
+		for key, array in tensors.items():
+			f.seek(data_start + table[key]['offset'])
+			f.write(array.tobytes())
+		f.truncate(data_start + offset)
+
+class WeightBundle:
+	""" Read side of a bundle written by write_bundle """
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError(path + ' is not a weight bundle, compile one with weight_bundle.py')
+			header_size = struct.unpack('<Q', f.read(8))[0]
+			self.header = json.loads(f.read(header_size).decode())
+		self.data_start = -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+		# copy-on-write: tensors stay writable (torch warns on read-only arrays) but the file is never modified
+		self.data = np.memmap(path, dtype=np.uint8, mode='c')
+		self.config = self.header['config']
+
+	def __contains__(self, name):
+		return name in self.header['models']
+
+	def state_dict(self, name):
+		""" tensors of one model, backed by the mapped file """
+		state = OrderedDict()
+		prefix = name + '.'
+		for key, entry in self.header['tensors'].items():
+			if key.startswith(prefix):
+				start = self.data_start + entry['offset']
+				array = self.data[start:start + entry['nbytes']].view(np.dtype(entry['dtype'])).reshape(entry['shape'])
+				state[key[len(prefix):]] = torch.from_numpy(array)
+		return state
+
+	def load(self, name, model):
+		""" Fold model's BatchNorms if they were folded at compile time, then assign the mapped tensors to it (no copy).
+		model should be freshly built in eval mode. Return: model
+		"""
+		if self.header['folded'][name]:
+			fold_batchnorms(model)
+		model.load_state_dict(self.state_dict(name), assign=True)
+		return model
+
+	def apply_config(self, cfg):
+		for field, value in self.config.items():
+			setattr(cfg, field, value)
+
+def compile_bundle(ocr, path):
+	""" Write the networks of an OCR whose load_net() has run (float SCATTER, i.e. without scatter_quantize) """
+	models = OrderedDict([('craft', ocr.craft)])
+	if ocr.refine_net is not None:
+		models['refine_net'] = ocr.refine_net
+	models['scatter'] = ocr.scatter.module
+	# fold_batchnorms_checked keeps the original model when folding changed its outputs
+	folded = {name: not any(isinstance(m, torch.nn.BatchNorm2d) for m in model.modules()) for name, model in models.items()}
+	config = {field: getattr(ocr.cfg, field) for field in config_fields}
+	write_bundle(path, models, config, folded)
+
+if __name__ == '__main__':
+	from ocr_config import Config
+	from ocr import OCR
+	parser = argparse.ArgumentParser(description='Compile the OCR checkpoints into one memory-mappable weight bundle')
+	parser.add_argument('--output', required=True, type=str, help='bundle file to write (Config.bundle_path)')
+	args = parser.parse_args()
+
+	cfg = Config()
+	cfg.cuda = False
+	cfg.bundle_path = None
+	cfg.scatter_quantize = False    # quantized layers keep packed weights, quantize at load time instead
+	ocr = OCR(cfg)
+	ocr.load_net()
+	compile_bundle(ocr, args.output)
+	print('wrote ' + args.output)